@@ -0,0 +1,91 @@
+"""
+Times the C45 gain search over every column of a table, computing each
+entropy from materialized partitions and from contingency counts
+
+    python -m benchmarks.c45 -n 100000 -c 50
+"""
+from __future__ import print_function
+import argparse
+import random
+import sys
+import time
+from hew.classifiers.c45 import C45
+
+if sys.version >= '3':
+    xrange = range
+
+
+def partitioned_gain(c45, col, res_col):
+    """ The gain of `col`, with a subtable built for each of its values """
+    s = 0
+    for subt in c45.partitionOnFeature(col):
+        s += (subt.flen(col) / c45.flen(col)) * subt.info(res_col)
+    return c45.info(res_col) - s
+
+
+def counted_gain(c45, col, res_col):
+    return c45.gain(col, res_col)
+
+
+def search(c45, res_col, gain):
+    start = time.time()
+    gains = [(k, gain(c45, k, res_col))
+             for k in sorted(c45.columnSet) if k != res_col]
+    return time.time() - start, gains
+
+
+def make_table(rows, columns, rng):
+    """ Columns of 2 to 20 values; the result depends on the first three """
+    cardinality = [rng.randint(2, 20) for _ in xrange(columns)]
+    table = {}
+    for j, m in enumerate(cardinality):
+        table['f{0}'.format(j)] = ['v{0}'.format(rng.randrange(m))
+                                   for _ in xrange(rows)]
+
+    signal = [table['f{0}'.format(j)] for j in xrange(min(3, columns))]
+    table['result'] = [
+        'yes' if sum(len(col[i]) for col in signal) % 2 or
+        rng.random() < 0.1 else 'no'
+        for i in xrange(rows)]
+    return table
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    table = make_table(args.rows, args.columns, rng)
+    sample = C45({k: v[:args.sample] for k, v in table.items()})
+    full = C45(table)
+
+    print('engine\trows\tcolumns\tseconds\trows_per_second')
+    elapsed, expected = search(sample, 'result', partitioned_gain)
+    print('partitioned\t{0}\t{1}\t{2:.3f}\t{3:.0f}'.format(
+        sample.size(), args.columns, elapsed, sample.size() / elapsed))
+
+    elapsed, actual = search(sample, 'result', counted_gain)
+    print('counted\t{0}\t{1}\t{2:.3f}\t{3:.0f}'.format(
+        sample.size(), args.columns, elapsed, sample.size() / elapsed))
+    mismatched = sum(1 for (_, a), (_, b) in zip(expected, actual)
+                     if abs(a - b) > 1e-9)
+    print('gains that differ: {0}'.format(mismatched), file=sys.stderr)
+
+    elapsed, _ = search(full, 'result', counted_gain)
+    print('counted\t{0}\t{1}\t{2:.3f}\t{3:.0f}'.format(
+        full.size(), args.columns, elapsed, full.size() / elapsed))
+
+
+def buildArgParser():
+    description = 'Time the C45 gain search'
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('-n', '--rows', default=100000, type=int,
+                   help='the number of rows in the table')
+    p.add_argument('-c', '--columns', default=50, type=int,
+                   help='the number of feature columns')
+    p.add_argument('--sample', default=5000, type=int,
+                   help='the number of rows timed with both engines')
+    p.add_argument('-s', '--seed', default=0, type=int,
+                   help='the random seed')
+    return p
+
+if __name__ == '__main__':
+    parser = buildArgParser()
+    run(parser.parse_args())
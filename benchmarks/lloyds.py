@@ -0,0 +1,77 @@
+"""
+Times one Lloyd iteration with the per-point engine and the batched engine
+
+    python -m benchmarks.lloyds -n 1000000 -k 50
+"""
+from __future__ import print_function
+import argparse
+import random
+import sys
+import time
+from hew.clusters.k_means import assign_clusters, update_centroids
+from hew.structures import vector
+
+if sys.version >= '3':
+    xrange = range
+
+DISTANCES = {
+    'euclid': vector.distance_euclid_squared,
+    'manhattan': vector.distance_manhattan,
+    'cosine': vector.distance_cosine_similarity,
+}
+
+
+def iteration(X, MU, distance_fn):
+    start = time.time()
+    C = assign_clusters(X, MU, distance_fn)
+    update_centroids(X, C, MU)
+    return time.time() - start, list(C)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    X = [tuple(rng.gauss(0, 1) for _ in xrange(args.dimensions))
+         for _ in xrange(args.points)]
+    MU = [list(x) for x in rng.sample(X, args.clusters)]
+    distance_fn = DISTANCES[args.distance]
+
+    print('engine\tn\tk\td\tseconds\tpoints_per_second')
+    sample = X[:args.sample]
+    elapsed, expected = iteration(sample, MU, distance_fn)
+    print('python\t{0}\t{1}\t{2}\t{3:.3f}\t{4:.0f}'.format(
+        len(sample), args.clusters, args.dimensions, elapsed,
+        len(sample) / elapsed))
+
+    if vector.numpy is None:
+        print('numpy is not installed', file=sys.stderr)
+        return
+
+    M = vector.as_matrix(X)
+    elapsed, actual = iteration(M, MU, distance_fn)
+    print('numpy\t{0}\t{1}\t{2}\t{3:.3f}\t{4:.0f}'.format(
+        len(X), args.clusters, args.dimensions, elapsed, len(X) / elapsed))
+
+    mismatched = sum(1 for a, b in zip(expected, actual) if a != b)
+    print('assignments that differ: {0}'.format(mismatched), file=sys.stderr)
+
+
+def buildArgParser():
+    description = 'Time the Lloyd iteration engines'
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('-n', '--points', default=1000000, type=int,
+                   help='the number of points to cluster')
+    p.add_argument('-k', '--clusters', default=50, type=int,
+                   help='the number of clusters')
+    p.add_argument('-d', '--dimensions', default=10, type=int,
+                   help='the number of dimensions')
+    p.add_argument('--sample', default=20000, type=int,
+                   help='the number of points timed with the python engine')
+    p.add_argument('--distance', default='euclid', choices=sorted(DISTANCES),
+                   help='the distance measurement to use')
+    p.add_argument('-s', '--seed', default=0, type=int,
+                   help='the random seed')
+    return p
+
+if __name__ == '__main__':
+    parser = buildArgParser()
+    run(parser.parse_args())
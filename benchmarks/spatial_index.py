@@ -0,0 +1,80 @@
+"""
+Compares KDTree and VPTree across dimensionality
+
+    python -m benchmarks.spatial_index -n 20000 -q 200
+"""
+from __future__ import print_function
+import argparse
+import random
+import sys
+import time
+from hew.structures.kd_tree import KDTree
+from hew.structures.metric import EuclideanSquared
+from hew.structures.vp_tree import VPTree
+
+if sys.version >= '3':
+    xrange = range
+
+
+class CountingEuclid(EuclideanSquared):
+    """ Counts the distance computations made by a search """
+    calls = 0
+
+    def distance(self, a, b):
+        CountingEuclid.calls += 1
+        return EuclideanSquared.distance(self, a, b)
+
+
+def measure(build, queries):
+    start = time.time()
+    tree = build()
+    built = time.time() - start
+
+    CountingEuclid.calls = 0
+    start = time.time()
+    for q in queries:
+        tree.nearest_neighbor(q)
+    elapsed = time.time() - start
+
+    return built, elapsed / len(queries), CountingEuclid.calls / len(queries)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    metric = CountingEuclid()
+
+    print('structure\td\tbuild_s\tquery_ms\tdistances_per_query\tn')
+    for d in args.dimensions:
+        points = [(tuple(rng.random() for _ in xrange(d)), i)
+                  for i in xrange(args.points)]
+        queries = [[rng.random() for _ in xrange(d)]
+                   for _ in xrange(args.queries)]
+
+        structures = [
+            ('KDTree', lambda: KDTree(points, metric)),
+            ('VPTree', lambda: VPTree(points, metric)),
+        ]
+        for name, build in structures:
+            built, per_query, calls = measure(build, queries)
+            print('{0}\t{1}\t{2:.3f}\t{3:.3f}\t{4:.0f}\t{5}'.format(
+                name, d, built, per_query * 1000, calls, args.points))
+            sys.stdout.flush()
+
+
+def buildArgParser():
+    description = 'Compare the nearest neighbor indexes'
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('-n', '--points', default=20000, type=int,
+                   help='the number of points to index')
+    p.add_argument('-q', '--queries', default=200, type=int,
+                   help='the number of lookups to time')
+    p.add_argument('-d', '--dimensions', default=[2, 5, 10, 15, 20, 30],
+                   type=int, nargs='+',
+                   help='the dimensionalities to compare')
+    p.add_argument('-s', '--seed', default=0, type=int,
+                   help='the random seed')
+    return p
+
+if __name__ == '__main__':
+    parser = buildArgParser()
+    run(parser.parse_args())
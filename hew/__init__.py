@@ -1,8 +1,10 @@
 # Provide the public interface to the module
 
 from hew.normalizer import Normalizer
-from hew.classifiers.c45 import C45
-from hew.clusters.k_means import KMeans
+from hew.classifiers.c45 import C45, CompiledTree
+from hew.classifiers.random_forest import RandomForest
+from hew.clusters.k_means import KMeans, MiniBatchKMeans
 from hew.structures.bk_tree import BKNode
 from hew.structures.kd_tree import KDTree
+from hew.structures.vp_tree import VPTree
 from hew.structures.vector import distance_euclid_squared as distance_fn
@@ -1,10 +1,76 @@
 from __future__ import print_function
+import os
 import sys
 import math
+import random
+import time
 import argparse
 import csv
+from array import array
+from hew.structures.column_store import ColumnStore
+from hew.structures.feature_buffer import parse_float
 from hew.structures.node import Node
-from collections import defaultdict
+from collections import Counter, defaultdict
+
+try:
+    from itertools import izip
+except ImportError:  # python3.x
+    izip = zip
+
+
+def entropy(counts):
+    """ Calculates the entropy of a distribution from the count of each
+        outcome.
+    """
+    total = float(sum(counts))
+    s = 0  # sum
+    for n in counts:
+        if n:
+            p = n / total
+            s += p * math.log(p, 2)
+    return -s
+
+
+# Confidence levels and their normal deviates, as tabulated by C4.5
+_CONFIDENCES = [0, 0.001, 0.005, 0.01, 0.05, 0.10, 0.20, 0.40, 1.00]
+_DEVIATIONS = [4.0, 3.09, 2.58, 2.33, 1.65, 1.28, 0.84, 0.25, 0.00]
+
+
+def added_errors(n, e, confidence=0.25):
+    """ Returns the errors to add to the _e_ observed among _n_ rows for the
+        upper limit of the error rate at _confidence_, as C4.5 estimates it
+        when pruning.
+    """
+    if e < 1e-6:
+        return n * (1 - math.exp(math.log(confidence) / n))
+    if e < 0.9999:
+        v0 = n * (1 - math.exp(math.log(confidence) / n))
+        return v0 + e * (added_errors(n, 1.0, confidence) - v0)
+    if e + 0.5 >= n:
+        return 0.67 * (n - e)
+
+    i = 0
+    while confidence > _CONFIDENCES[i]:
+        i += 1
+    coeff = _DEVIATIONS[i - 1] + (_DEVIATIONS[i] - _DEVIATIONS[i - 1]) * \
+        (confidence - _CONFIDENCES[i - 1]) / \
+        (_CONFIDENCES[i] - _CONFIDENCES[i - 1])
+    coeff *= coeff
+
+    p = (e + 0.5 + coeff / 2 +
+         math.sqrt(coeff * ((e + 0.5) * (1 - (e + 0.5) / n) + coeff / 4))) / \
+        (n + coeff)
+    return n * p - e
+
+
+CRITERIA = ('gain', 'gainRatio')
+
+# the settings of the root table a checkpoint must be resumed with
+_SETTINGS = ('maxDepth', 'criterion', 'minSamplesSplit', 'minSamplesLeaf',
+             'maxFeatures')
+
+# the lines of rules buffered before they are written
+OUTPUT_ROWS = 10000
 
 
 class C45(object):
@@ -14,63 +80,199 @@ class C45(object):
     and Timothy Trukhanov -> https://github.com/geerk/C45algorithm
     """
 
-    def __init__(self, dictionaryOfLists, validate=True):
-        self.columnSet = dictionaryOfLists
-        self.partitionKey = None
-        self.partitionValue = None
+    def __init__(self, dictionaryOfLists, validate=True, numeric=None):
+        """ `dictionaryOfLists` holds the table by column.  It is encoded
+            into a `ColumnStore`, which every partition of the table shares.
+            `numeric` names the numeric columns, which are split on a
+            threshold.  If None, they are detected from their values.
+        """
+        if validate:
+            self._validate(dictionaryOfLists)
+        self._attachRoot(ColumnStore.fromColumns(dictionaryOfLists, numeric))
+
+    def _attachRoot(self, store):
+        """ Makes the table hold every row of _store_ """
+        self._attachStore(store, array('l', range(len(store))), store.names)
         self.depth = 1
+        # None leaves the depth unbounded
         self.maxDepth = 100
-        if validate:
-            self._validate()
+        # one of `CRITERIA`
+        self.criterion = 'gain'
+        # the fewest rows a table needs to be split, and each side to keep
+        self.minSamplesSplit = 2
+        self.minSamplesLeaf = 1
+        # if set, each node only considers this many columns drawn with `rng`
+        self.maxFeatures = None
+        self.rng = None
+        # the nodes built and seconds spent at each depth, shared by every
+        # partition of the table
+        self.stats = {}
 
-    def _validate(self):
-        assert isinstance(self.columnSet, dict)
-        assert len(self.columnSet)
-        size = self.size()
-        for k, v in self.columnSet.items():
+    def _validate(self, dictionaryOfLists):
+        assert isinstance(dictionaryOfLists, dict)
+        assert len(dictionaryOfLists)
+        size = len(next(iter(dictionaryOfLists.values())))
+        for k, v in dictionaryOfLists.items():
             assert k
             assert isinstance(k, str)
             assert len(v) == size
 
+    def _attachStore(self, store, indexes, columns):
+        self.store = store
+        self.indexes = indexes
+        self.columns = list(columns)
+        # the rows sorted by each numeric column, see `order`
+        self.orders = {}
+        self.partitionKey = None
+        self.partitionOp = '='
+        self.partitionValue = None
+        # the count of each code of a column, and the entropy of the result
+        # column, kept once computed; see `histogram` and `info`
+        self.histograms = {}
+        self.infos = {}
+        # the entropies computed for the table, see `_entropy`
+        self.entropies = 0
+
+    def _view(self, indexes):
+        """ Returns a table of the rows at _indexes_ of the shared store.
+        """
+        sub = C45.__new__(C45)
+        sub._attachStore(self.store, indexes, self.columns)
+        sub.depth = self.depth + 1
+        sub.maxDepth = self.maxDepth
+        sub.criterion = self.criterion
+        sub.minSamplesSplit = self.minSamplesSplit
+        sub.minSamplesLeaf = self.minSamplesLeaf
+        sub.maxFeatures = self.maxFeatures
+        sub.rng = self.rng
+        sub.stats = self.stats
+        return sub
+
+    def _copy(self):
+        """ Returns a table of the same rows, settings and partition that
+            a tree is built from, so the table itself keeps its rows.
+        """
+        copy = C45.__new__(C45)
+        copy.__dict__.update(self.__dict__)
+        copy.columns = list(self.columns)
+        copy.orders = dict(self.orders)
+        copy.histograms = dict(self.histograms)
+        copy.infos = dict(self.infos)
+        return copy
+
+    @property
+    def columnSet(self):
+        """ The values of the table by column.  They are decoded on every
+            call, so this is meant for inspection rather than computation.
+        """
+        return {k: self.store.column(k, self._rows()) for k in self.columns}
+
+    def _codes(self, col):
+        """ Returns the codes of column _col_ for the rows of the table.
+        """
+        return map(self.store.codes[col].__getitem__, self._rows())
+
     #--------------------------------------------------------------------------
 
     @classmethod
-    def fromTable(cls, arrayOfDictionaries):
-        T = defaultdict(list)
-        for row in arrayOfDictionaries:
-            for col in row:
-                T[col].append(row[col])
-        return C45(T)
+    def fromStore(cls, store):
+        """ Returns a table of every row of the `ColumnStore` _store_ """
+        assert len(store.names)
+        c45 = cls.__new__(cls)
+        c45._attachRoot(store)
+        return c45
+
+    @classmethod
+    def fromTable(cls, arrayOfDictionaries, numeric=None):
+        """ Encodes any iterable of dictionaries one row at a time """
+        return cls.fromStore(ColumnStore.fromRows(arrayOfDictionaries,
+                                                  numeric))
+
+    @classmethod
+    def fromFile(cls, fileName, numeric=None, dialect=csv.excel_tab):
+        """ Streams the rows of a delimited text file into the store, so
+            only their encoded values are kept.
+        """
+        with open(fileName, 'r') as f:
+            reader = csv.DictReader(f, dialect=dialect)
+            return cls.fromTable(reader, numeric)
 
     #--------------------------------------------------------------------------
 
     def rule(self):
         if not self.partitionKey:
             return ''
-        return '{0}={1}'.format(self.partitionKey, self.partitionValue)
+        return '{0}{1}{2}'.format(self.partitionKey, self.partitionOp,
+                                  self.partitionValue)
+
+    def _rows(self):
+        """ The indexes of the rows of the table, which a table no longer
+            holds once a tree is built from it, see `_release`.
+        """
+        if self.indexes is None:
+            raise ValueError('The rows of a split table are released, '
+                             'only its size and results are kept')
+        return self.indexes
 
     def size(self):
-        col = list(self.columnSet.keys())[0]
-        return len(self.columnSet[col])
+        if self.indexes is None:
+            return self.rows
+        return len(self.indexes)
 
     def flen(self, col):
         """ Returns the length of column _col_ as a float.
         """
-        return float(len(self.columnSet[col]))
+        return float(len(self._rows()))
+
+    def isNumeric(self, col):
+        return col in self.store.numbers
+
+    def order(self, col):
+        """ Returns the indexes of the rows sorted by numeric column _col_.
+            Partitions inherit the orders of their parent, so each column is
+            sorted once for the whole tree.
+        """
+        order = self.orders.get(col)
+        if order is None:
+            key = self.store.numbers[col].__getitem__
+            order = self.orders[col] = array('l', sorted(self._rows(),
+                                                         key=key))
+        return order
 
     def uniques(self, col):
-        return list(set(self.columnSet[col]))
+        values = self.store.values[col]
+        if col in self.histograms:
+            codes = self.histograms[col]
+        else:
+            codes = set(self._codes(col))
+        return [values[c] for c in sorted(codes)]
 
     def frequency(self, col, v):
         """ Returns counts of variant _v_ in column _col_.
         """
-        return self.columnSet[col].count(v)
+        code = self.store.encode(col, v)
+        if code is None:
+            return 0
+        return sum(1 for c in self._codes(col) if c == code)
+
+    def histogram(self, col):
+        """ Returns a Counter of the codes of column _col_.  It is computed
+            once per table; partitioning on a column hands each subtable the
+            histogram of its results, so those are never counted again.
+        """
+        histogram = self.histograms.get(col)
+        if histogram is None:
+            histogram = self.histograms[col] = Counter(self._codes(col))
+        return histogram
 
     def isHomogeneous(self, col):
         """ Returns True if all values in _col_ are equal and False otherwise.
         """
-        t0 = self.columnSet[col][0]
-        for i in self.columnSet[col]:
+        if col in self.histograms:
+            return len(self.histograms[col]) <= 1
+        codes = iter(self._codes(col))
+        t0 = next(codes)
+        for i in codes:
             if i != t0:
                 return False
         return True
@@ -78,113 +280,927 @@ class C45(object):
     def get_indexes(self, col, v):
         """ Returns indexes of values _v_ in column _col_.
         """
-        return {i for i, x in enumerate(self.columnSet[col]) if x == v}
+        code = self.store.encode(col, v)
+        return {i for i, x in enumerate(self._codes(col)) if x == code}
+
+    def counts(self, col, res_col):
+        """ Returns the contingency table of column _col_ against _res_col_,
+            the count of each result for every value of _col_, built in a
+            single pass.
+        """
+        values = self.store.values[col]
+        results = self.store.values[res_col]
+        table = defaultdict(dict)
+        pairs = Counter(izip(self._codes(col), self._codes(res_col)))
+        for (v, r), n in pairs.items():
+            table[values[v]][results[r]] = n
+        return table
 
     def get_values(self, col, indexes):
         """ Returns values of _indexes_ in column _col_
         """
-        column = self.columnSet[col]
-        return [column[i] for i in range(len(column)) if i in indexes]
+        mine = self._rows()
+        rows = [mine[i] for i in sorted(set(indexes)) if 0 <= i < len(mine)]
+        return self.store.column(col, rows)
 
     #--------------------------------------------------------------------------
 
+    def _entropy(self, counts):
+        """ `entropy`, counted in `entropies` """
+        self.entropies += 1
+        return entropy(counts)
+
     def info(self, res_col):
         """ Calculates the entropy where res_col column = _res_col_.
+            It is computed from `histogram` once per table.
         """
-        s = 0  # sum
-        result_len = self.flen(res_col)
-        for v in self.uniques(res_col):
-            p = self.frequency(res_col, v) / result_len
-            s += p * math.log(p, 2)
-        return -s
+        e = self.infos.get(res_col)
+        if e is None:
+            e = self.infos[res_col] = self._entropy(
+                self.histogram(res_col).values())
+        return e
+
+    def threshold(self, col, res_col):
+        """ Finds the split of numeric column _col_ into the rows <= and >
+            a threshold that leaves the least entropy, moving the rows from
+            the right to the left side in one pass over their sorted order.
+            Returns (index of the row holding the threshold, entropy), or
+            (None, None) if every value of _col_ is equal or no threshold
+            leaves `minSamplesLeaf` rows on both sides.
+        """
+        numbers = self.store.numbers[col]
+        results = self.store.codes[res_col]
+        order = self.order(col)
+
+        right = Counter(self.histogram(res_col))
+        left = defaultdict(int)
+        size = float(len(order))
+        leaf = self.minSamplesLeaf
+        best = (None, None)
+        for j in range(len(order) - 1):
+            i = order[j]
+            r = results[i]
+            left[r] += 1
+            right[r] -= 1
+            if numbers[i] == numbers[order[j + 1]]:
+                continue
+
+            n = j + 1
+            if n < leaf or size - n < leaf:
+                continue
+            e = (n / size * self._entropy(left.values()) +
+                 (size - n) / size * self._entropy(right.values()))
+            if best[1] is None or e < best[1]:
+                best = (i, e)
+        return best
 
     def infox(self, col, res_col):
         """ Calculates the entropy of the after dividing it on the subtables
-            by column _col_.
+            by column _col_.  Only the counts of each subtable are needed, so
+            the subtables themselves are never built.
+            Returns None if column _col_ cannot be split, or would leave
+            fewer than `minSamplesLeaf` rows in a subtable.
         """
+        if self.isNumeric(col):
+            return self.threshold(col, res_col)[1]
+
         s = 0  # sum
-        for subt in self.partitionOnFeature(col):
-            s += (subt.flen(col) / self.flen(col)) * subt.info(res_col)
+        size = self.flen(col)
+        for histogram in self.counts(col, res_col).values():
+            n = sum(histogram.values())
+            if n < self.minSamplesLeaf:
+                return None
+            s += (n / size) * self._entropy(histogram.values())
         return s
 
     def gain(self, x, res_col):
         """ The criterion for selecting attributes for splitting.
+            Returns None if column _x_ cannot split the table.
         """
-        return self.info(res_col) - self.infox(x, res_col)
+        e = self.infox(x, res_col)
+        if e is None:
+            return None
+        return self.info(res_col) - e
+
+    def gainRatio(self, x, res_col):
+        """ The gain of column _x_ divided by the entropy of the sizes of the
+            subtables it makes, so that columns with many values are not
+            preferred for that alone.
+            Returns None if column _x_ cannot split the table.
+        """
+        if self.isNumeric(x):
+            row, e = self.threshold(x, res_col)
+            if row is None:
+                return None
+            numbers = self.store.numbers[x]
+            t = numbers[row]
+            n = sum(1 for i in self._rows() if numbers[i] <= t)
+            split = self._entropy([n, self.size() - n])
+        else:
+            e = self.infox(x, res_col)
+            if e is None:
+                return None
+            split = self._entropy(self.histogram(x).values())
+
+        if not split:
+            return None
+        return (self.info(res_col) - e) / split
+
+    def score(self, x, res_col):
+        """ The value of splitting on column _x_ by the `criterion` in use """
+        if self.criterion == 'gainRatio':
+            return self.gainRatio(x, res_col)
+        return self.gain(x, res_col)
 
     #--------------------------------------------------------------------------
 
     def buildPartition(self, col, v):
-        idxs = self.get_indexes(col, v)
-        p = {k: [x for i, x in enumerate(v) if i in idxs]
-             for k, v in self.columnSet.items()}
-
-        sub = C45(p, False)
-        sub.depth = self.depth + 1
-        sub.maxDepth = self.maxDepth
+        """ Returns the subtable of the rows where column _col_ = _v_.  It
+            holds the indexes of its rows, not a copy of them.
+        """
+        code = self.store.encode(col, v)
+        codes = self.store.codes[col]
+        sub = self._view(array('l', [i for i in self._rows()
+                                     if codes[i] == code]))
         sub.partitionKey = col
         sub.partitionValue = v
         return sub
 
-    def partitionOnFeature(self, col):
-        """ Returns subtables divided by values of the column _col_.
+    def partitionOnFeature(self, col, res_col=None):
+        """ Returns subtables divided by values of the column _col_,
+            filtering the indexes in a single pass.
+            If _res_col_ is given, a numeric column is divided in two on the
+            threshold that `threshold` finds for it, and each subtable gets
+            the histogram of its results, counted in the same pass.  Without
+            _res_col_, a numeric column is divided by value like any other.
         """
-        return [self.buildPartition(col, v) for v in self.uniques(col)]
+        if self.isNumeric(col) and res_col is not None:
+            return self._partitionOnThreshold(col, res_col)
 
-    #--------------------------------------------------------------------------
+        codes = self.store.codes[col]
+        groups = defaultdict(lambda: array('l'))
+        if res_col is None:
+            for i in self._rows():
+                groups[codes[i]].append(i)
+        else:
+            results = self.store.codes[res_col]
+            histograms = defaultdict(Counter)
+            for i in self._rows():
+                code = codes[i]
+                groups[code].append(i)
+                histograms[code][results[i]] += 1
 
-    def buildTree(self, res_col):
-        tree = Node(self)
+        keys = sorted(groups)
+        result = []
+        for code in keys:
+            sub = self._view(groups[code])
+            sub.partitionKey = col
+            sub.partitionValue = self.store.decode(col, code)
+            if res_col is not None:
+                sub.histograms[res_col] = histograms[code]
+            result.append(sub)
 
-        if self.depth > self.maxDepth:
-            return tree
+        position = dict((code, j) for j, code in enumerate(keys))
+        self._inheritOrders(result, lambda i: position[codes[i]])
+        return result
 
-        gain_list = [(k, self.gain(k, res_col))
-                     for k in self.columnSet if k != res_col]
-        if not gain_list:
-            return tree
+    def _partitionOnThreshold(self, col, res_col):
+        row, _ = self.threshold(col, res_col)
+        if row is None:
+            return [self._view(self._rows())]
+
+        numbers = self.store.numbers[col]
+        t = numbers[row]
 
-        col = max(gain_list, key=lambda x: x[1])[0]
-        for subt in self.partitionOnFeature(col):
-            if subt.isHomogeneous(res_col):
-                tree.add(Node(subt))
+        results = self.store.codes[res_col]
+        left = array('l')
+        right = array('l')
+        leftCounts = Counter()
+        rightCounts = Counter()
+        for i in self._rows():
+            if numbers[i] <= t:
+                left.append(i)
+                leftCounts[results[i]] += 1
             else:
-                del subt.columnSet[col]
-                tree.add(subt.buildTree(res_col))
+                right.append(i)
+                rightCounts[results[i]] += 1
+
+        result = []
+        for op, indexes, histogram in (('<=', left, leftCounts),
+                                       ('>', right, rightCounts)):
+            sub = self._view(indexes)
+            sub.histograms[res_col] = histogram
+            sub.partitionKey = col
+            sub.partitionOp = op
+            sub.partitionValue = self.store.decode(col,
+                                                   self.store.codes[col][row])
+            result.append(sub)
+
+        self._inheritOrders(result, lambda i: 0 if numbers[i] <= t else 1)
+        return result
+
+    def _inheritOrders(self, subtables, position):
+        """ Hands each subtable its share of the sorted orders, keeping them
+            sorted.  _position_ maps a row index to its subtable.
+        """
+        for col, order in self.orders.items():
+            parts = [array('l') for _ in subtables]
+            for i in order:
+                parts[position(i)].append(i)
+            for sub, part in zip(subtables, parts):
+                sub.orders[col] = part
+
+    #--------------------------------------------------------------------------
+
+    def __getstate__(self):
+        """ The shared store is left out when a table is pickled; it is put
+            back by whoever unpickles the table.
+        """
+        state = self.__dict__.copy()
+        state['store'] = None
+        return state
+
+    def buildTree(self, res_col, workers=1, columnLevels=2, checkpoint=None,
+                  interval=60.):
+        """ Returns the tree of subtables split on the columns with the most
+            gain, built by a `TreeBuilder`.
+            With more than one of _workers_, the gains of the columns are
+            spread over a process pool for the first _columnLevels_ levels,
+            then each remaining subtree is built by a single process.  The
+            tree is the same as the one built serially, so columns cannot be
+            drawn at random with `maxFeatures`, as the draws would depend on
+            the order the processes take the nodes in.
+            With a _checkpoint_ file name, a serial build saves its progress
+            to that file every _interval_ seconds, and resumes from it if it
+            exists, raising a ValueError if it was saved for another result
+            column or other split settings.  The file is removed once the
+            tree is complete.
+        """
+        if self.criterion not in CRITERIA:
+            raise ValueError('Unknown criterion {0}'.format(self.criterion))
+        if workers > 1:
+            if checkpoint:
+                raise ValueError('A parallel build cannot be checkpointed')
+            if self.maxFeatures:
+                raise ValueError('A parallel build cannot draw maxFeatures '
+                                 'columns')
+            return _buildParallel(self, res_col, workers, columnLevels)
+
+        if checkpoint and os.path.exists(checkpoint):
+            builder = TreeBuilder.load(checkpoint, self, res_col)
+        else:
+            builder = TreeBuilder(self, res_col)
+        tree = builder.build(checkpoint, interval)
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
         return tree
 
+    def _grow(self, res_col):
+        """ Scores the columns of the table and splits it on the best one.
+            Returns the subtables, each with whether it still has to be
+            split, or an empty list if the table is a leaf.
+        """
+        started = time.time()
+        children = []
+        if self._splittable():
+            col = self._bestColumn([(k, self.score(k, res_col))
+                                    for k in self._candidates(res_col)])
+            if col is not None:
+                children = self._split(col, res_col)
+                self._release(res_col)
+        self._record(time.time() - started)
+        return children
+
+    def _release(self, res_col):
+        """ Drops what only scoring the table needed once it is split: the
+            indexes of its rows and the sorted orders, which the subtables
+            hold their share of, and the histograms of the columns other than
+            _res_col_.  The number of rows is kept for `size`, and reading
+            the rows raises a ValueError.  A build splits a `_copy` of the
+            table it is given, so that table keeps its rows.
+        """
+        self.orders = {}
+        self.histograms = {res_col: self.histogram(res_col)}
+        self.rows = len(self.indexes)
+        self.indexes = None
+
+    def _candidates(self, res_col):
+        """ The columns a node may split on: every column but _res_col_, or
+            `maxFeatures` of them drawn at random for each node.
+        """
+        candidates = [k for k in self.columns if k != res_col]
+        if self.maxFeatures and self.maxFeatures < len(candidates):
+            candidates = (self.rng or random).sample(candidates,
+                                                     self.maxFeatures)
+        return candidates
+
+    def _splittable(self):
+        return ((self.maxDepth is None or self.depth <= self.maxDepth) and
+                self.size() >= self.minSamplesSplit)
+
+    def _leaf(self):
+        self._record(0.)
+        return Node(self)
+
+    def _record(self, seconds):
+        level = self.stats.setdefault(self.depth, {'nodes': 0, 'seconds': 0.,
+                                                   'entropies': 0})
+        level['nodes'] += 1
+        level['seconds'] += seconds
+        level['entropies'] += self.entropies
+
+    def _bestColumn(self, gain_list):
+        """ Returns the column with the most gain, or None if no column can
+            split the table.
+        """
+        gain_list = [g for g in gain_list if g[1] is not None]
+        if not gain_list:
+            return None
+        return max(gain_list, key=lambda x: x[1])[0]
+
+    def _split(self, col, res_col):
+        """ Returns the subtables of the split on column _col_, each with
+            whether it still has to be split.  A categorical column is used
+            up once it is split on, a numeric one can split again.
+        """
+        result = []
+        for subt in self.partitionOnFeature(col, res_col):
+            grow = not subt.isHomogeneous(res_col)
+            if grow and not self.isNumeric(col):
+                subt.columns.remove(col)
+            result.append((subt, grow))
+        return result
+
+    @classmethod
+    def prune(cls, tree, res_col, confidence=0.25):
+        """ Replaces each subtree of _tree_ with a leaf when the leaf is not
+            expected to make more errors, by the pessimistic estimate of C4.5
+            at _confidence_.  Children are visited before their parents.
+            Returns the number of subtrees replaced.
+        """
+        order = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children)
+
+        pruned = 0
+        estimates = {}
+        for node in reversed(order):
+            c45 = node.data
+            n = c45.size()
+            e = n - max(c45.histogram(res_col).values())
+            leaf = e + added_errors(n, e, confidence)
+            if node.children:
+                subtree = sum(estimates.pop(id(c)) for c in node.children)
+                if leaf <= subtree + 0.1:
+                    node.children = []
+                    pruned += 1
+                else:
+                    leaf = subtree
+            estimates[id(node)] = leaf
+        return pruned
+
     @classmethod
     def outputDecision(cls, node, res_col, predicates, fout):
-        c45 = node.data
-        rule = c45.rule()
-        if rule:
-            predicates.append(rule)
+        """ Writes a line for each leaf under _node_, depth first, with the
+            rules that lead to it after those in _predicates_.  A single list
+            of rules is kept for the path being walked, and lines are written
+            `OUTPUT_ROWS` at a time.
+        """
+        predicates = list(predicates)
+        lines = []
+        # (node, the number of rules above it)
+        stack = [(node, len(predicates))]
+        while stack:
+            node, n = stack.pop()
+            del predicates[n:]
+            c45 = node.data
+            rule = c45.rule()
+            if rule:
+                predicates.append(rule)
+
+            if node.children:
+                n = len(predicates)
+                stack.extend((c, n) for c in reversed(node.children))
+                continue
 
-        if not node.children:
             target = "~".join(set(c45.uniques(res_col)))
-            line = "{0}\t{1}\t{2}={3}\t{4}".format(c45.size(), len(predicates),
-                                                   res_col, target,
-                                                   ' & '.join(predicates))
-            print(line, file=fout)
-        else:
-            for c in node.children:
-                cls.outputDecision(c, res_col, list(predicates), fout)
+            lines.append("{0}\t{1}\t{2}={3}\t{4}\n".format(
+                c45.size(), len(predicates), res_col, target,
+                ' & '.join(predicates)))
+            if len(lines) >= OUTPUT_ROWS:
+                fout.write(''.join(lines))
+                del lines[:]
+        fout.write(''.join(lines))
 
     @classmethod
-    def makeDecisionTree(cls, arrayOfDictionaries, res_col, fout, maxDepth=20):
-        """ Returns a tree of decisions from _arrayOfDictionaries_
+    def makeDecisionTree(cls, arrayOfDictionaries, res_col, fout, maxDepth=20,
+                         workers=1, numeric=None, criterion='gain',
+                         minSamplesSplit=2, minSamplesLeaf=1, confidence=None,
+                         checkpoint=None):
+        """ Returns a tree of decisions from _arrayOfDictionaries_, or from a
+            table built with `fromFile`
             _res_col_ must be the name of field that contains the target result
+            _workers_ is the number of processes that build the tree
+            _numeric_ names the numeric columns, detected if None
+            _criterion_, _minSamplesSplit_ and _minSamplesLeaf_ are set on the
+            root table
+            _confidence_ if provided, prunes the tree at that confidence
+            _checkpoint_ if provided, is the file a serial build saves its
+            progress to and resumes from, see `buildTree`
         """
-        root = C45.fromTable(arrayOfDictionaries)
-        if res_col not in root.columnSet:
+        if isinstance(arrayOfDictionaries, C45):
+            root = arrayOfDictionaries
+        else:
+            root = C45.fromTable(arrayOfDictionaries, numeric)
+        if res_col not in root.columns:
             print(res_col, 'is not a valid column. Exiting.', file=sys.stderr)
             return
 
         root.maxDepth = maxDepth
-        a = root.buildTree(res_col)
+        root.criterion = criterion
+        root.minSamplesSplit = minSamplesSplit
+        root.minSamplesLeaf = minSamplesLeaf
+        a = root.buildTree(res_col, workers, checkpoint=checkpoint)
+        if confidence:
+            C45.prune(a, res_col, confidence)
         print('Count\tPath_Length\tResult\tPredicates', file=fout)
         C45.outputDecision(a, res_col, [], fout)
+        return a
+
+
+# -----------------------------------------------------------------------------
+# Parallel training
+#
+# The store is handed to every worker process once, when it starts.  Tasks
+# carry only the row indexes of a subtable, and subtrees come back without the
+# store, which is reattached to each of their tables.
+# -----------------------------------------------------------------------------
+
+_split_state = {}
+
+
+def _init_split_worker(store, res_col):
+    _split_state['store'] = store
+    _split_state['res_col'] = res_col
+
+
+def _gain_job(sub):
+    """ Returns the score of each column of a copy of one subtable, and the
+        entropies that took.
+    """
+    sub.store = _split_state['store']
+    res_col = _split_state['res_col']
+    return [(k, sub.score(k, res_col)) for k in sub.columns], sub.entropies
+
+
+def _subtree_job(subt):
+    subt.store = _split_state['store']
+    subt.stats = {}
+    nodes = _flatten(subt.buildTree(_split_state['res_col']))
+    return ([node.data for node in nodes],
+            [len(node.children) for node in nodes], subt.stats)
+
+
+def _attach(tree, store, stats):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        node.data.store = store
+        node.data.stats = stats
+        stack.extend(node.children)
+    return tree
+
+
+def _parallelGains(c45, res_col, candidates, pool, workers):
+    c45.info(res_col)
+    step = -(-len(candidates) // workers)
+    jobs = []
+    for i in range(0, len(candidates), step):
+        group = candidates[i:i + step]
+        sub = c45._view(c45.indexes)
+        sub.depth = c45.depth
+        sub.columns = group
+        sub.orders = dict((k, c45.order(k))
+                          for k in group if c45.isNumeric(k))
+        sub.histograms = {res_col: c45.histogram(res_col)}
+        sub.infos = c45.infos
+        jobs.append(sub)
+
+    result = []
+    for gains, entropies in pool.map(_gain_job, jobs):
+        result.extend(gains)
+        c45.entropies += entropies
+    return result
+
+
+def _buildColumns(c45, res_col, pool, workers, columnLevels, pending):
+    """ Builds the top levels of the tree, leaving a placeholder for each
+        subtree deeper than _columnLevels_ in _pending_.
+    """
+    started = time.time()
+    tree = Node(c45)
+
+    candidates = c45._candidates(res_col) if c45._splittable() else []
+    if not candidates:
+        c45._record(time.time() - started)
+        return tree
+
+    col = c45._bestColumn(_parallelGains(c45, res_col, candidates, pool,
+                                         workers))
+    if col is None:
+        c45._record(time.time() - started)
+        return tree
 
+    children = c45._split(col, res_col)
+    c45._release(res_col)
+    c45._record(time.time() - started)
+    for subt, grow in children:
+        if not grow:
+            tree.add(subt._leaf())
+        elif subt.depth <= columnLevels:
+            tree.add(_buildColumns(subt, res_col, pool, workers,
+                                   columnLevels, pending))
+        else:
+            pending.append((tree, len(tree.children), subt))
+            tree.add(None)
+    return tree
+
+
+def _buildParallel(c45, res_col, workers, columnLevels):
+    import multiprocessing
+
+    pool = multiprocessing.Pool(workers, _init_split_worker,
+                                (c45.store, res_col))
+    try:
+        pending = []
+        tree = _buildColumns(c45._copy(), res_col, pool, workers, columnLevels,
+                             pending)
+        subtrees = pool.imap(_subtree_job, [subt for _, _, subt in pending])
+        for (parent, i, _), (data, counts, stats) in zip(pending, subtrees):
+            subtree = _unflatten(data, counts)[0]
+            parent.children[i] = _attach(subtree, c45.store, c45.stats)
+            for depth, level in stats.items():
+                total = c45.stats.setdefault(depth, dict.fromkeys(level, 0))
+                for key in level:
+                    total[key] += level[key]
+    finally:
+        pool.terminate()
+        pool.join()
+    return tree
+
+# -----------------------------------------------------------------------------
+# Iterative construction
+# -----------------------------------------------------------------------------
+
+
+def _flatten(tree):
+    """ Returns the nodes of _tree_ in depth-first order """
+    nodes = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(node.children))
+    return nodes
+
+
+def _unflatten(data, counts):
+    """ Rebuilds the nodes returned by `_flatten` from the data and the
+        number of children of each.  Returns them in the same order, the
+        root first.
+    """
+    nodes = [Node(d) for d in data]
+    # [parent, children it still waits for]
+    parents = []
+    for node, n in izip(nodes, counts):
+        if parents:
+            parent = parents[-1]
+            parent[0].add(node)
+            parent[1] -= 1
+            if not parent[1]:
+                parents.pop()
+        if n:
+            parents.append([node, n])
+    return nodes
+
+
+class TreeBuilder(object):
+    """
+    Builds the tree of a `C45` table from an explicit stack of the nodes that
+    are still to be split, depth first, so the depth of the tree is not
+    bound by the recursion limit.  A table drops its rows and scoring state
+    once it is split, so only the leaves and the nodes on the stack hold the
+    indexes of their rows, and only those on the stack their sorted orders.
+    The partial tree and the stack can be saved with `save` and the build
+    resumed with `load`.
+    """
+
+    def __init__(self, table, res_col):
+        self.res_col = res_col
+        self.rows = len(table.store)
+        self.tree = Node(table._copy())
+        self.stack = [self.tree]
+
+    def __len__(self):
+        """ The number of nodes still to be split """
+        return len(self.stack)
+
+    def step(self):
+        """ Splits the node on top of the stack, and pushes its subtables
+            that still have to be split.
+        """
+        node = self.stack.pop()
+        grown = []
+        for subt, grow in node.data._grow(self.res_col):
+            child = Node(subt) if grow else subt._leaf()
+            node.add(child)
+            if grow:
+                grown.append(child)
+        self.stack.extend(reversed(grown))
+
+    def build(self, checkpoint=None, interval=60.):
+        """ Splits nodes until the stack is empty, saving the builder to
+            _checkpoint_ every _interval_ seconds if a file name is given.
+            Returns the tree.
+        """
+        saved = time.time()
+        while self.stack:
+            self.step()
+            if checkpoint and time.time() - saved >= interval:
+                self.save(checkpoint)
+                saved = time.time()
+        return self.tree
+
+    def __getstate__(self):
+        # the nodes are flattened, as pickling a deep tree would recurse
+        nodes = _flatten(self.tree)
+        position = dict((id(node), i) for i, node in enumerate(nodes))
+        return {
+            'res_col': self.res_col,
+            'rows': self.rows,
+            'data': [node.data for node in nodes],
+            'counts': [len(node.children) for node in nodes],
+            'stack': [position[id(node)] for node in self.stack],
+        }
+
+    def __setstate__(self, state):
+        nodes = _unflatten(state['data'], state['counts'])
+        self.res_col = state['res_col']
+        self.rows = state['rows']
+        self.tree = nodes[0]
+        self.stack = [nodes[i] for i in state['stack']]
+
+    def save(self, fileName):
+        """ Pickles the partial tree and the stack, without the store.  The
+            file is written beside _fileName_ and then renamed over it, so
+            an interrupted save leaves the previous checkpoint intact.
+        """
+        import pickle
+
+        temporary = fileName + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        getattr(os, 'replace', os.rename)(temporary, fileName)
+
+    @classmethod
+    def load(cls, fileName, table, res_col):
+        """ Opens a builder written by `save`.  The store of the `C45`
+            _table_, which must hold the same rows, is attached to it.  The
+            tree must predict _res_col_ and its root have the split settings
+            of _table_.
+        """
+        import pickle
+
+        with open(fileName, 'rb') as f:
+            builder = pickle.load(f)
+        if builder.rows != len(table.store):
+            raise ValueError('{0} holds a tree of {1} rows, not {2}'.format(
+                fileName, builder.rows, len(table.store)))
+        if builder.res_col != res_col:
+            raise ValueError('{0} holds a tree of {1}, not {2}'.format(
+                fileName, builder.res_col, res_col))
+        root = builder.tree.data
+        for name in _SETTINGS:
+            if getattr(root, name) != getattr(table, name):
+                raise ValueError('{0} holds a tree with {1}={2}, not {3}'
+                                 .format(fileName, name, getattr(root, name),
+                                         getattr(table, name)))
+        for node in _flatten(builder.tree):
+            node.data.store = table.store
+        return builder
+
+# -----------------------------------------------------------------------------
+# Prediction
+#
+# A built tree is flattened breadth-first into arrays, so the children of a
+# node sit next to each other and are found from the offset of the first one.
+# -----------------------------------------------------------------------------
+
+LEAF = -1
+
+
+class CompiledTree(object):
+    """ A decision tree flattened into arrays, for classifying rows without
+        the table it was built from.
+    """
+
+    @classmethod
+    def fromTree(cls, tree, res_col):
+        """ Compiles the `Node` tree returned by `C45.buildTree`.
+        """
+        compiled = cls(res_col)
+        fields = {}
+        codes = {}
+
+        queue = [(tree, -1)]
+        head = 0
+        while head < len(queue):
+            node, value = queue[head]
+            head += 1
+            c45 = node.data
+
+            counts = c45.histogram(res_col)
+            best = max(sorted(counts), key=counts.__getitem__)
+            compiled.label.append(c45.store.decode(res_col, best))
+            compiled.value.append(value)
+
+            if not node.children:
+                compiled.feature.append(LEAF)
+                compiled.threshold.append(0.)
+                compiled.first.append(0)
+                compiled.count.append(0)
+                continue
+
+            col = node.children[0].data.partitionKey
+            if col not in fields:
+                fields[col] = len(compiled.fields)
+                compiled.fields.append(col)
+                compiled.codebooks.append(None if c45.isNumeric(col) else [])
+                codes[col] = {}
+            f = fields[col]
+
+            compiled.feature.append(f)
+            compiled.first.append(len(queue))
+            compiled.count.append(len(node.children))
+            codebook = compiled.codebooks[f]
+            if codebook is None:
+                compiled.threshold.append(
+                    parse_float(node.children[0].data.partitionValue))
+                queue.extend((child, -1) for child in node.children)
+            else:
+                compiled.threshold.append(0.)
+                for child in node.children:
+                    v = child.data.partitionValue
+                    if v not in codes[col]:
+                        codes[col][v] = len(codebook)
+                        codebook.append(v)
+                    queue.append((child, codes[col][v]))
+
+        compiled._index()
+        return compiled
+
+    def __init__(self, res_col):
+        self.res_col = res_col
+        self.fields = []
+        # the values of each categorical field, None for numeric fields
+        self.codebooks = []
+        self.feature = array('i')
+        self.threshold = array('d')
+        self.first = array('i')
+        self.count = array('i')
+        # the code of the value that leads to each node, -1 if none does
+        self.value = array('i')
+        # the most common result at each node
+        self.label = []
+        self._branches = []
+        self._lookup = []
+
+    def __len__(self):
+        return len(self.feature)
+
+    def _index(self):
+        """ Builds the dictionaries that find a child from a value.
+        """
+        self._lookup = [None if codebook is None else
+                        dict((v, code) for code, v in enumerate(codebook))
+                        for codebook in self.codebooks]
+        self._branches = []
+        for node, f in enumerate(self.feature):
+            if f == LEAF or self.codebooks[f] is None:
+                self._branches.append(None)
+                continue
+            start = self.first[node]
+            children = range(start, start + self.count[node])
+            self._branches.append(dict((self.value[c], c) for c in children))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_branches']
+        del state['_lookup']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index()
+
+    def predict(self, row):
+        """ Returns the result for the dictionary _row_.  A value the tree
+            has not seen, or a missing or unreadable numeric value, stops at
+            the node that would test it and returns the most common result
+            there.
+        """
+        node = 0
+        while True:
+            f = self.feature[node]
+            if f == LEAF:
+                return self.label[node]
+
+            v = row.get(self.fields[f])
+            lookup = self._lookup[f]
+            if lookup is None:
+                try:
+                    x = parse_float(v)
+                except ValueError:
+                    x = None
+                if x is None:
+                    return self.label[node]
+                child = self.first[node] + (0 if x <= self.threshold[node]
+                                            else 1)
+            else:
+                child = self._branches[node].get(lookup.get(v))
+                if child is None:
+                    return self.label[node]
+            node = child
+
+    def predict_many(self, rows, workers=1, chunksize=10000):
+        """ Returns the result for each dictionary of _rows_, using a
+            process pool if there is more than one of _workers_.
+        """
+        if workers <= 1:
+            return [self.predict(row) for row in rows]
+
+        import multiprocessing
+
+        pool = multiprocessing.Pool(workers, _init_predict_worker, (self,))
+        try:
+            return list(pool.imap(_predict_job, rows, chunksize))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def save(self, fileName):
+        """ Writes the tree as JSON.
+        """
+        import json
+
+        model = {
+            'result': self.res_col,
+            'fields': self.fields,
+            'codebooks': self.codebooks,
+            'feature': list(self.feature),
+            'threshold': list(self.threshold),
+            'first': list(self.first),
+            'count': list(self.count),
+            'value': list(self.value),
+            'label': self.label,
+        }
+        with open(fileName, 'w') as f:
+            json.dump(model, f)
+
+    @classmethod
+    def load(cls, fileName):
+        """ Opens a tree written by `save`.
+        """
+        import json
+
+        with open(fileName, 'r') as f:
+            model = json.load(f)
+
+        compiled = cls(model['result'])
+        compiled.fields = model['fields']
+        compiled.codebooks = model['codebooks']
+        compiled.feature = array('i', model['feature'])
+        compiled.threshold = array('d', model['threshold'])
+        compiled.first = array('i', model['first'])
+        compiled.count = array('i', model['count'])
+        compiled.value = array('i', model['value'])
+        compiled.label = model['label']
+        compiled._index()
+        return compiled
+
+
+_predict_state = {}
+
+
+def _init_predict_worker(compiled):
+    _predict_state['tree'] = compiled
+
+
+def _predict_job(row):
+    return _predict_state['tree'].predict(row)
 
 # -----------------------------------------------------------------------------
 # Main
@@ -202,7 +1218,28 @@ def buildArgParser():
                    help='the name of the file that will hold the results')
     p.add_argument('--max', nargs='?', action='store', type=int,
                    dest='maxDepth', default=20,
-                   help='the maximum depth the features will split')
+                   help='the maximum depth the features will split, '
+                        '0 for no limit')
+    p.add_argument('--workers', type=int, default=1,
+                   help='the number of processes that build the tree')
+    p.add_argument('--numeric', action='append', default=None,
+                   help='a numeric column, split on a threshold; '
+                        'if none are given they are detected')
+    p.add_argument('--criterion', default='gain', choices=CRITERIA,
+                   help='the measure used to choose the column to split on')
+    p.add_argument('--min-split', type=int, default=2,
+                   dest='minSamplesSplit',
+                   help='the fewest rows a node needs to be split')
+    p.add_argument('--min-leaf', type=int, default=1, dest='minSamplesLeaf',
+                   help='the fewest rows each side of a split must keep')
+    p.add_argument('--prune', type=float, default=None, dest='confidence',
+                   help='prune the tree at this confidence, 0.25 in C4.5')
+    p.add_argument('--checkpoint', default=None, metavar='fileName',
+                   help='save the progress of the build to this file, and '
+                        'resume from it if it exists')
+    p.add_argument('--stats', action='store_true',
+                   help='write the nodes, seconds and entropies of each '
+                        'level to stderr')
 
     return p
 
@@ -210,9 +1247,18 @@ if __name__ == '__main__':
     parser = buildArgParser()
     args = parser.parse_args()
 
-    with open(args.input, 'r') as f:
-        reader = csv.DictReader(f, dialect=csv.excel_tab)
-        data = [row for row in reader]
+    data = C45.fromFile(args.input, args.numeric)
 
     with open(args.output, 'w') as f:
-        C45.makeDecisionTree(data, args.target, f, args.maxDepth)
+        tree = C45.makeDecisionTree(data, args.target, f,
+                                    args.maxDepth or None, args.workers,
+                                    args.numeric, args.criterion,
+                                    args.minSamplesSplit, args.minSamplesLeaf,
+                                    args.confidence, args.checkpoint)
+
+    if args.stats and tree is not None:
+        print('depth\tnodes\tseconds\tentropies_per_node', file=sys.stderr)
+        for depth, level in sorted(tree.data.stats.items()):
+            print('{0}\t{1}\t{2:.3f}\t{3:.1f}'.format(
+                depth, level['nodes'], level['seconds'],
+                level['entropies'] / float(level['nodes'])), file=sys.stderr)
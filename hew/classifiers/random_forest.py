@@ -0,0 +1,251 @@
+from __future__ import print_function
+import sys
+import math
+import random
+import argparse
+import csv
+from array import array
+from collections import Counter
+from hew.classifiers.c45 import C45, CompiledTree, CRITERIA
+
+if sys.version >= '3':
+    xrange = range
+
+
+class RandomForest(object):
+    """
+    An ensemble of `C45` trees.  Each tree grows on a bootstrap sample of the
+    rows of the table, and each of its nodes chooses among a random subset of
+    the columns.  Grown trees are kept as `CompiledTree`s, and the forest
+    predicts the result most of them vote for.
+    """
+
+    # -------------------------------------------------------------------------
+    # Factory Methods
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fromTable(cls, arrayOfDictionaries, res_col, nTrees=10,
+                  maxFeatures=None, workers=1, seed=None, numeric=None):
+        """ Grows a forest from any iterable of dictionaries """
+        forest = cls(res_col, nTrees, maxFeatures, seed=seed)
+        return forest.fit(C45.fromTable(arrayOfDictionaries, numeric),
+                          workers)
+
+    @classmethod
+    def fromFile(cls, fileName, res_col, nTrees=10, maxFeatures=None,
+                 workers=1, seed=None, numeric=None):
+        """ Grows a forest from the rows of a delimited text file """
+        forest = cls(res_col, nTrees, maxFeatures, seed=seed)
+        return forest.fit(C45.fromFile(fileName, numeric), workers)
+
+    # -------------------------------------------------------------------------
+    # Customization Methods
+    # -------------------------------------------------------------------------
+    def __init__(self, res_col, nTrees=10, maxFeatures=None, maxDepth=20,
+                 criterion='gain', minSamplesSplit=2, minSamplesLeaf=1,
+                 seed=None):
+        """
+        `res_col` is the column that holds the result
+        `nTrees` is the number of trees grown
+        `maxFeatures` is the number of columns each node chooses among, the
+            square root of the number of feature columns if None
+        `maxDepth`, `criterion`, `minSamplesSplit` and `minSamplesLeaf` are
+            set on the root of every tree, see `C45`
+        `seed` drives the samples and columns of every tree, so the forest
+            is reproducible whatever the number of workers
+        """
+        assert nTrees > 0
+        assert criterion in CRITERIA
+
+        if seed is None:
+            seed = random.randrange(1 << 31)
+
+        self.res_col = res_col
+        self.nTrees = nTrees
+        self.maxFeatures = maxFeatures
+        self.maxDepth = maxDepth
+        self.criterion = criterion
+        self.minSamplesSplit = minSamplesSplit
+        self.minSamplesLeaf = minSamplesLeaf
+        self.seed = seed
+        self.trees = []
+
+    def __len__(self):
+        return len(self.trees)
+
+    # -------------------------------------------------------------------------
+    # Training
+    # -------------------------------------------------------------------------
+
+    def fit(self, table, workers=1):
+        """ Grows `nTrees` trees on the rows of the `C45` _table_, one tree
+            per task of a pool of _workers_ processes.
+            Returns the forest.
+        """
+        assert self.res_col in table.columns
+        import multiprocessing
+
+        self.trees = []
+        jobs = list(xrange(self.nTrees))
+        workers = min(workers, self.nTrees)
+        if workers <= 1:
+            _init_grow_worker(self, table, table.store)
+            try:
+                self.trees = [_grow_job(i) for i in jobs]
+            finally:
+                _grow_state.clear()
+        else:
+            pool = multiprocessing.Pool(workers, _init_grow_worker,
+                                        (self, table, table.store))
+            try:
+                self.trees = pool.map(_grow_job, jobs, 1)
+            finally:
+                pool.terminate()
+                pool.join()
+        return self
+
+    def features(self, table):
+        """ The number of columns each node of a tree of _table_ chooses
+            among.
+        """
+        if self.maxFeatures:
+            return self.maxFeatures
+        n = len(table.columns) - 1
+        return max(1, int(round(math.sqrt(n))))
+
+    def grow(self, table, i):
+        """ Grows and compiles tree _i_ of the forest from a bootstrap sample
+            of the rows of _table_.
+        """
+        rng = random.Random('{0}:{1}'.format(self.seed, i))
+        rows = table.indexes
+        n = len(rows)
+        sample = array('l', [rows[rng.randrange(n)] for _ in xrange(n)])
+
+        root = table._view(sample)
+        root.depth = 1
+        root.maxDepth = self.maxDepth
+        root.criterion = self.criterion
+        root.minSamplesSplit = self.minSamplesSplit
+        root.minSamplesLeaf = self.minSamplesLeaf
+        root.maxFeatures = self.features(table)
+        root.rng = rng
+        root.stats = {}
+        return CompiledTree.fromTree(root.buildTree(self.res_col),
+                                     self.res_col)
+
+    # -------------------------------------------------------------------------
+    # Prediction
+    # -------------------------------------------------------------------------
+
+    def votes(self, row):
+        """ Returns a Counter of the results the trees give for _row_ """
+        return Counter(tree.predict(row) for tree in self.trees)
+
+    def predict(self, row):
+        """ Returns the result most trees give for the dictionary _row_.
+            A tie goes to the result of the earliest tree.
+        """
+        return self.votes(row).most_common(1)[0][0]
+
+    def predict_many(self, rows, workers=1, chunksize=10000):
+        """ Returns the result for each dictionary of _rows_, using a
+            process pool if there is more than one of _workers_.
+        """
+        if workers <= 1:
+            return [self.predict(row) for row in rows]
+
+        import multiprocessing
+
+        pool = multiprocessing.Pool(workers, _init_vote_worker, (self,))
+        try:
+            return list(pool.imap(_vote_job, rows, chunksize))
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+_grow_state = {}
+
+
+def _init_grow_worker(forest, table, store):
+    table.store = store
+    _grow_state['forest'] = forest
+    _grow_state['table'] = table
+
+
+def _grow_job(i):
+    return _grow_state['forest'].grow(_grow_state['table'], i)
+
+
+_vote_state = {}
+
+
+def _init_vote_worker(forest):
+    _vote_state['forest'] = forest
+
+
+def _vote_job(row):
+    return _vote_state['forest'].predict(row)
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+
+def buildArgParser():
+    description = 'Grow a random forest and predict the result of each row'
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('input', metavar='inputFileName',
+                   help='the file the trees are grown from')
+    p.add_argument('target',  metavar='targetColumn',
+                   help='the column that holds the expected result')
+    p.add_argument('output', nargs='?', metavar='outputFileName',
+                   default='predictions.txt',
+                   help='the name of the file that will hold the predictions')
+    p.add_argument('--test', default=None, metavar='testFileName',
+                   help='the rows to predict, those of the input by default')
+    p.add_argument('--trees', type=int, default=10, dest='nTrees',
+                   help='the number of trees')
+    p.add_argument('--features', type=int, default=None, dest='maxFeatures',
+                   help='the number of columns each node chooses among')
+    p.add_argument('--max', type=int, default=20, dest='maxDepth',
+                   help='the maximum depth of each tree')
+    p.add_argument('--criterion', default='gain', choices=CRITERIA,
+                   help='the measure used to choose the column to split on')
+    p.add_argument('--min-split', type=int, default=2,
+                   dest='minSamplesSplit',
+                   help='the fewest rows a node needs to be split')
+    p.add_argument('--min-leaf', type=int, default=1, dest='minSamplesLeaf',
+                   help='the fewest rows each side of a split must keep')
+    p.add_argument('--numeric', action='append', default=None,
+                   help='a numeric column, split on a threshold; '
+                        'if none are given they are detected')
+    p.add_argument('--workers', type=int, default=1,
+                   help='the number of processes that grow the trees and '
+                        'predict')
+    p.add_argument('--seed', type=int, default=None,
+                   help='the random seed')
+    return p
+
+if __name__ == '__main__':
+    parser = buildArgParser()
+    args = parser.parse_args()
+
+    forest = RandomForest(args.target, args.nTrees, args.maxFeatures,
+                          args.maxDepth, args.criterion, args.minSamplesSplit,
+                          args.minSamplesLeaf, args.seed)
+    forest.fit(C45.fromFile(args.input, args.numeric), args.workers)
+
+    with open(args.test or args.input, 'r') as f:
+        reader = csv.DictReader(f, dialect=csv.excel_tab)
+        fields = reader.fieldnames + ['prediction']
+        rows = [row for row in reader]
+
+    predictions = forest.predict_many(rows, args.workers)
+    with open(args.output, 'w') as f:
+        writer = csv.DictWriter(f, fields, dialect=csv.excel_tab)
+        writer.writeheader()
+        for row, prediction in zip(rows, predictions):
+            row['prediction'] = prediction
+            writer.writerow(row)
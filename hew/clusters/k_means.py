@@ -1,8 +1,11 @@
 import sys
 import csv
+import time
 import random
 import argparse
 
+from array import array
+from itertools import islice
 
 try:
     from itertools import izip
@@ -12,20 +15,15 @@ except ImportError:  # python3.x
 if sys.version >= '3':
     xrange = range
 
-# -----------------------------------------------------------------------------
-# obj -> obj
-# -----------------------------------------------------------------------------
+# the most distances held in memory at once when assigning with numpy
+BATCH_CELLS = 1 << 22
 
+# the fewest centroids for which `predict` searches a tree instead of
+# comparing each point with every centroid
+INDEX_MIN_K = 64
 
-def convertBooleanFields(o):
-    for k, v in o.items():
-        if v.lower() == 'false':
-            o[k] = 0.
-        elif v.lower() == 'true':
-            o[k] = 1.
-        else:
-            o[k] = v
-    return o
+# the rows written to the output of the command line at once
+OUTPUT_ROWS = 10000
 
 # -----------------------------------------------------------------------------
 # Adapted from
@@ -41,99 +39,687 @@ def convertBooleanFields(o):
 # d  :: number of dimensions
 
 # -----------------------------------------------------------------------------
-# Cluster Algorithms
+# Seeding
+#
+# Every point keeps its distance to the closest centroid chosen so far, which
+# only has to be compared with the newest centroid on each round.  Points are
+# drawn by bisecting the cumulative sum of their weights.
 # -----------------------------------------------------------------------------
 
 
-def has_converged(A, B):
-    return set([tuple(a) for a in A]) == set([tuple(b) for b in B])
+def _seeding_distance(X, distance_fn):
+    """ Returns `X`, as a numpy matrix if the distance has a batched form,
+    and a function that gives the distance from every point to a centroid
+    """
+    from hew.structures.metric import metric_for
+    from hew.structures.vector import as_matrix, batched_distance, numpy
+
+    batched = batched_distance(distance_fn)
+    if batched:
+        M = as_matrix(X)
+
+        def to_centroid(mu):
+            mu = numpy.asarray([mu], dtype=numpy.float64)
+            return batched(M, mu)[:, 0]
+        return M, to_centroid
+
+    try:
+        distance = metric_for(distance_fn).distance
+    except ValueError:
+        distance = distance_fn
+
+    def to_centroid(mu):
+        return [distance(x, mu) for x in X]
+    return X, to_centroid
+
+
+def _closer(dist, new):
+    """ The smaller of each pair of distances """
+    from hew.structures.vector import numpy
+
+    if isinstance(dist, list):
+        return [a if a <= b else b for a, b in izip(dist, new)]
+    return numpy.minimum(dist, new, out=dist)
+
+
+def _weighted(dist, weights):
+    if weights is None:
+        return dist
+    if isinstance(dist, list):
+        return [a * b for a, b in izip(dist, weights)]
+    return dist * weights
+
+
+def _sample(weights, rng):
+    """ Draws an index with a probability proportional to its weight """
+    from bisect import bisect_right
+
+    n = len(weights)
+    if isinstance(weights, list):
+        cumulative = []
+        total = 0.
+        for w in weights:
+            total += w
+            cumulative.append(total)
+    else:
+        cumulative = weights.cumsum()
+        total = float(cumulative[-1])
+
+    if total <= 0:
+        return rng.randrange(n)
+    return min(bisect_right(cumulative, rng.random() * total), n - 1)
+
+
+def _plus_plus(X, k, distance_fn, weights=None, rng=random):
+    M, to_centroid = _seeding_distance(X, distance_fn)
+
+    if weights is None:
+        first = rng.randrange(len(X))
+    else:
+        first = _sample(weights, rng)
+    MU = [list(X[first])]
+    dist = to_centroid(MU[0])
+
+    for _ in xrange(1, k):
+        j = _sample(_weighted(dist, weights), rng)
+        MU.append(list(X[j]))
+        dist = _closer(dist, to_centroid(MU[-1]))
+
+    return MU
 
 
 # http://rosettacode.org/wiki/K-means%2B%2B_clustering#Python
 # https://datasciencelab.wordpress.com/2014/01/15/improved-seeding-for-clustering-with-k-means/
-def kmeans_plus_plus(X, k, distance_fn):
-    """ Determines `k` centroids from an array of points `X` """
-
-    def min_dist(x, C):
-        result = float("inf")
-        for c in C:
-            d = distance_fn(x, c)
-            if d < result:
-                result = d
-        return result
-
-    l = len(X)
-    MU = [None] * k
-    dist = [0.] * l
-
-    MU[0] = list(random.choice(X))
-
-    for i in xrange(1, k):
-        accum = 0.
-        centroids = MU[:i]
-        for j, x in enumerate(X):
-            dist[j] = min_dist(x, centroids)
-            accum += dist[j]
-
-        accum *= random.random()
-
-        for j, d in enumerate(dist):
-            accum -= d
-            if accum <= 0:
-                MU[i] = list(X[j])
-                break
+def kmeans_plus_plus(X, k, distance_fn, rng=random):
+    """ Determines `k` centroids from an array of points `X`
+    `rng` is the source of randomness, a `random.Random` or the module
+    """
+    return _plus_plus(X, k, distance_fn, rng=rng)
 
-    return MU
+
+# http://vldb.org/pvldb/vol5/p622_bahmanbahmani_vldb2012.pdf
+def kmeans_parallel(X, k, distance_fn, rounds=5, oversampling=None,
+                    rng=random):
+    """ Determines `k` centroids from an array of points `X` with k-means||.
+    Each of the `rounds` passes over `X` samples about `oversampling`
+    candidates (2 * k by default) instead of one, then the candidates,
+    weighted by the number of points closest to them, are reduced to `k`
+    with k-means++.
+    """
+    from hew.structures.vector import numpy
+
+    l = oversampling or 2 * k
+    n = len(X)
+    M, to_centroid = _seeding_distance(X, distance_fn)
+
+    candidates = [rng.randrange(n)]
+    dist = to_centroid(X[candidates[0]])
+    for _ in xrange(rounds):
+        psi = float(sum(dist))
+        if psi <= 0:
+            break
+        chosen = [i for i, d in enumerate(dist)
+                  if rng.random() * psi < l * d]
+        for i in chosen:
+            dist = _closer(dist, to_centroid(X[i]))
+        candidates.extend(chosen)
+
+    candidates = sorted(set(candidates))
+    if len(candidates) <= k:
+        return _plus_plus(X, k, distance_fn, rng=rng)
+
+    points = [tuple(X[i]) for i in candidates]
+    weights = [0.] * len(points)
+    for j in assign_clusters(M, points, distance_fn):
+        weights[j] += 1
+    if numpy is not None and not isinstance(dist, list):
+        weights = numpy.asarray(weights)
+
+    return _plus_plus(points, k, distance_fn, weights, rng)
+
+
+def random_seeding(X, k, distance_fn, rng=random):
+    """ Picks `k` distinct points of `X` at random """
+    return [list(x) for x in rng.sample(list(set(X)), k)]
+
+
+SEEDINGS = {
+    'random': random_seeding,
+    'k-means++': kmeans_plus_plus,
+    'k-means||': kmeans_parallel,
+}
+
+
+def assign_clusters(X, MU, distance_fn):
+    """ Returns the index of the closest centroid in `MU` for each point.
+    If `X` is a numpy matrix and `distance_fn` has a batched form, the
+    distances are computed a block of points at a time.
+    """
+    return _assign(X, MU, distance_fn)[0]
+
+
+def _assign(X, MU, distance_fn):
+    """ Returns the assignments and the total distance from each point to
+    its centroid
+    """
+    from hew.structures.metric import metric_for
+    from hew.structures.vector import batched_distance, numpy
+
+    batched = batched_distance(distance_fn)
+    if batched and isinstance(X, numpy.ndarray):
+        M = numpy.asarray(MU, dtype=numpy.float64)
+        k, d = M.shape
+        n = len(X)
+        step = max(1, BATCH_CELLS // (k * d))
+        C = numpy.empty(n, dtype=numpy.intp)
+        inertia = 0.
+        for start in xrange(0, n, step):
+            D = batched(X[start:start + step], M)
+            c = D.argmin(axis=1)
+            C[start:start + step] = c
+            inertia += float(D[numpy.arange(len(c)), c].sum())
+        return C, inertia
+
+    try:
+        distance = metric_for(distance_fn).distance
+    except ValueError:
+        distance = distance_fn
+
+    C = [0] * len(X)
+    inertia = 0.
+    for i, x in enumerate(X):
+        best = float("inf")
+        for j, mu in enumerate(MU):
+            d = distance(x, mu)
+            if d < best:
+                best = d
+                C[i] = j
+        inertia += best
+    return C, inertia
+
+
+def members(C, k):
+    """ Returns the indexes of the points in each of the `k` clusters """
+    from hew.structures.vector import numpy
+
+    if numpy is not None and isinstance(C, numpy.ndarray):
+        order = numpy.argsort(C, kind='stable')
+        ends = numpy.cumsum(numpy.bincount(C, minlength=k))
+        return numpy.split(order, ends[:-1])
+
+    result = [array('l') for _ in xrange(k)]
+    for i, c in enumerate(C):
+        result[c].append(i)
+    return result
+
+
+def inertia(X, MU, C, distance_fn):
+    """ The total distance from each point to the centroid of its cluster,
+    visiting the points one cluster at a time
+    """
+    from hew.structures.metric import metric_for
+    from hew.structures.vector import as_matrix, batched_distance, numpy
+
+    batched = batched_distance(distance_fn)
+    if batched:
+        X = as_matrix(X)
+        C = numpy.asarray(C, dtype=numpy.intp)
+        M = numpy.asarray(MU, dtype=numpy.float64)
+        step = max(1, BATCH_CELLS // M.shape[1])
+        total = 0.
+        for j, indexes in enumerate(members(C, len(M))):
+            for start in xrange(0, len(indexes), step):
+                rows = X[indexes[start:start + step]]
+                total += float(batched(rows, M[j:j + 1]).sum())
+        return total
+
+    try:
+        distance = metric_for(distance_fn).distance
+    except ValueError:
+        distance = distance_fn
+    return sum(distance(x, MU[c]) for x, c in izip(X, C))
+
+
+def update_centroids(X, C, MU):
+    """ Returns the centroid of each cluster, summing the points in a single
+    pass.  A cluster that has lost all of its points keeps its old centroid.
+    """
+    from hew.structures.vector import numpy
+
+    k = len(MU)
+    d = len(MU[0])
+
+    if numpy is not None and isinstance(X, numpy.ndarray):
+        counts = numpy.bincount(C, minlength=k)
+        sums = numpy.empty((k, d))
+        for axis in xrange(d):
+            sums[:, axis] = numpy.bincount(C, weights=X[:, axis],
+                                           minlength=k)
+        return [(s / n).tolist() if n else list(mu)
+                for s, n, mu in izip(sums, counts, MU)]
+
+    sums = [[0.] * d for _ in xrange(k)]
+    counts = [0] * k
+    for x, j in izip(X, C):
+        s = sums[j]
+        counts[j] += 1
+        for i, v in enumerate(x):
+            s[i] += v
+    return [[v / n for v in s] if n else list(mu)
+            for s, n, mu in izip(sums, counts, MU)]
+
+
+# -----------------------------------------------------------------------------
+# Convergence
+#
+# An algorithm stops when any of these hold after an iteration
+#   - no more than `max_changed` points moved to another cluster
+#   - the centroids moved, in total, no more than `tol` times the mean
+#     variance of the dimensions (the squared Euclidean distance is used
+#     whatever the metric, as the centroids are arithmetic means)
+#   - `max_iter` iterations have run
+# With the defaults, it stops when the assignments stop changing, as the
+# centroids are then unchanged as well.
+# -----------------------------------------------------------------------------
+
+
+def _tolerance(X, tol):
+    """ Scales `tol` by the mean variance of the dimensions of `X` """
+    from hew.structures.running_statistics import RunningStatistics
+    from hew.structures.vector import numpy
+
+    if not tol:
+        return 0.
+    if numpy is not None and isinstance(X, numpy.ndarray):
+        return tol * float(X.var(axis=0).mean())
+
+    stats = [RunningStatistics() for _ in X[0]]
+    for x in X:
+        for s, v in izip(stats, x):
+            s += v
+    return tol * sum(s.variance for s in stats) / len(stats)
+
+
+def _shift(old, new):
+    """ The total squared Euclidean distance moved by the centroids """
+    from hew.structures.vector import distance_euclid_squared
+
+    return sum(distance_euclid_squared(a, b) for a, b in izip(old, new))
+
+
+def _changed(old_C, C):
+    """ The number of points assigned to a different cluster """
+    if old_C is None:
+        return len(C)
+    if isinstance(C, list):
+        return sum(1 for a, b in izip(old_C, C) if a != b)
+    return int((old_C != C).sum())
+
+
+def _iteration_stats(computed, skipped, changed, shift, inertia, started,
+                     assigned):
+    """ The statistics given to `stats_hook`.
+    `inertia` is None for the algorithms that only keep bounds on distances
+    """
+    return {
+        'computed': computed,
+        'skipped': skipped,
+        'changed': changed,
+        'shift': shift,
+        'inertia': inertia,
+        'assign_seconds': assigned - started,
+        'update_seconds': time.time() - assigned,
+    }
 
 
 # https://en.wikipedia.org/wiki/Lloyd%27s_algorithm
-def lloyds_algorithm(X, initial_MU, distance_fn, calc_hook=None):
+def lloyds_algorithm(X, initial_MU, distance_fn, calc_hook=None,
+                     vectorize=True, max_iter=300, tol=0., max_changed=0,
+                     stats_hook=None):
     """
     'X' is the array of points,
     'initial_MU' is the initial array of centroids
     'distance_fn' a method that calculates the distance between to vectors
-    'calc_hook' if provided, will be called on every iteration
+    'calc_hook' if provided, will be called on every iteration with the
+        centroids, the assignments and the iteration count
+    'stats_hook' if provided, will be called on every iteration with a
+        dictionary of statistics for the iteration, see `_iteration_stats`
+    'vectorize' if True and numpy is installed, the built-in distances are
+        computed as batched matrices
+    'max_iter', 'tol' and 'max_changed' decide when to stop, see above
+    """
+    from hew.structures.vector import as_matrix, batched_distance
+
+    if vectorize and batched_distance(distance_fn):
+        X = as_matrix(X)
+
+    threshold = _tolerance(X, tol)
+    n = len(X)
+    MU = [list(mu) for mu in initial_MU]
+    C = None
+    iterations = 0
+    done = False
+
+    while not done:
+        iterations += 1
+        started = time.time()
+
+        old_C = C
+        C, inertia = _assign(X, MU, distance_fn)
+        assigned = time.time()
+
+        old = MU
+        MU = update_centroids(X, C, MU)
+
+        changed = _changed(old_C, C)
+        shift = _shift(old, MU)
+        done = (changed <= max_changed or shift <= threshold or
+                iterations >= max_iter)
+
+        if calc_hook:
+            calc_hook(MU, C, iterations)
+        if stats_hook:
+            stats_hook(_iteration_stats(n * len(MU), 0, changed, shift,
+                                        inertia, started, assigned))
+
+    if not isinstance(C, list):
+        C = C.tolist()
+    return MU, C, iterations
+
+
+# -----------------------------------------------------------------------------
+# Accelerated variants of Lloyd's algorithm
+#
+# Both keep bounds on the distance from each point to the centroids and use
+# the triangle inequality to skip the distances that cannot change the
+# assignment.  They give the same clusters as `lloyds_algorithm` but need a
+# distance that is a true metric, so squared Euclidean distances are replaced
+# by their square root.
+# -----------------------------------------------------------------------------
+
+
+def _center_distances(MU, distance):
+    """ Returns the distances between all centroids, and half the distance
+    from each centroid to its closest neighbor
+    """
+    k = len(MU)
+    cc = [[0.] * k for _ in xrange(k)]
+    for j in xrange(k):
+        for jj in xrange(j + 1, k):
+            cc[j][jj] = cc[jj][j] = distance(MU[j], MU[jj])
+
+    s = [0.] * k
+    if k > 1:
+        for j, row in enumerate(cc):
+            s[j] = 0.5 * min(d for jj, d in enumerate(row) if jj != j)
+    return cc, s
+
+
+def _two_closest(x, MU, distance):
+    """ Returns the index of the closest centroid, its distance and the
+    distance to the second closest centroid
     """
-    from hew.structures.vector import centroid
+    best_j, best, second = 0, float("inf"), float("inf")
+    for j, mu in enumerate(MU):
+        d = distance(x, mu)
+        if d < best:
+            best_j, best, second = j, d, best
+        elif d < second:
+            second = d
+    return best_j, best, second
+
 
-    MU = list(initial_MU)
+# http://www.cs.ucsd.edu/~elkan/kmeansicml03.pdf
+def elkan_algorithm(X, initial_MU, distance_fn, calc_hook=None,
+                    max_iter=300, tol=0., max_changed=0, stats_hook=None):
+    """
+    Keeps an upper bound and `k` lower bounds per point, which skips the
+    most distances but needs memory for n * k bounds.
+    The arguments are the same as `lloyds_algorithm`
+    """
+    from hew.structures.metric import metric_distance
+
+    distance = metric_distance(distance_fn)
+    threshold = _tolerance(X, tol)
+    MU = [list(mu) for mu in initial_MU]
     k = len(MU)
-    C = [None] * len(X)
+    n = len(X)
+
+    C = [0] * n
+    U = [0.] * n
+    L = [None] * n
+
     iterations = 0
     done = False
 
     while not done:
-        old = list(MU)
         iterations += 1
+        started = time.time()
+
+        if iterations == 1:
+            for i, x in enumerate(X):
+                row = [distance(x, mu) for mu in MU]
+                C[i] = row.index(min(row))
+                U[i] = row[C[i]]
+                L[i] = row
+            computed = n * k
+            changed = n
+        else:
+            computed = changed = 0
+            cc, s = _center_distances(MU, distance)
+            for i, x in enumerate(X):
+                c = C[i]
+                u = U[i]
+                if u <= s[c]:
+                    continue
+
+                row = L[i]
+                tight = False
+                for j in xrange(k):
+                    if j == c or u <= row[j] or u <= 0.5 * cc[c][j]:
+                        continue
+                    if not tight:
+                        u = row[c] = distance(x, MU[c])
+                        computed += 1
+                        tight = True
+                        if u <= row[j] or u <= 0.5 * cc[c][j]:
+                            continue
+                    row[j] = distance(x, MU[j])
+                    computed += 1
+                    if row[j] < u:
+                        c = j
+                        u = row[j]
+                if c != C[i]:
+                    changed += 1
+                C[i] = c
+                U[i] = u
+        assigned = time.time()
+
+        old = MU
+        MU = update_centroids(X, C, MU)
+
+        shift = _shift(old, MU)
+        done = (changed <= max_changed or shift <= threshold or
+                iterations >= max_iter)
+
+        delta = [] if done else [distance(a, b) for a, b in izip(old, MU)]
+        if any(delta):
+            for i in xrange(n):
+                L[i] = [max(l - dl, 0.) for l, dl in izip(L[i], delta)]
+                U[i] += delta[C[i]]
+
+        if calc_hook:
+            calc_hook(MU, C, iterations)
+        if stats_hook:
+            stats_hook(_iteration_stats(computed, n * k - computed, changed,
+                                        shift, None, started, assigned))
+
+    return MU, C, iterations
+
+
+# http://epubs.siam.org/doi/abs/10.1137/1.9781611972801.12
+def hamerly_algorithm(X, initial_MU, distance_fn, calc_hook=None,
+                      max_iter=300, tol=0., max_changed=0, stats_hook=None):
+    """
+    Keeps an upper bound and a single lower bound per point, which skips
+    fewer distances than Elkan's algorithm but only needs memory for 2 * n
+    bounds.
+    The arguments are the same as `lloyds_algorithm`
+    """
+    from hew.structures.metric import metric_distance
+
+    distance = metric_distance(distance_fn)
+    threshold = _tolerance(X, tol)
+    MU = [list(mu) for mu in initial_MU]
+    k = len(MU)
+    n = len(X)
+
+    C = [0] * n
+    U = [0.] * n
+    L = [0.] * n
+
+    iterations = 0
+    done = False
+
+    while not done:
+        iterations += 1
+        started = time.time()
+
+        if iterations == 1:
+            for i, x in enumerate(X):
+                C[i], U[i], L[i] = _two_closest(x, MU, distance)
+            computed = n * k
+            changed = n
+        else:
+            computed = changed = 0
+            _, s = _center_distances(MU, distance)
+            for i, x in enumerate(X):
+                m = max(s[C[i]], L[i])
+                if U[i] <= m:
+                    continue
+
+                U[i] = distance(x, MU[C[i]])
+                computed += 1
+                if U[i] <= m:
+                    continue
 
-        for i, x in enumerate(X):
-            C[i] = min(xrange(k), key=lambda j: distance_fn(x, MU[j]))
-        for j, _ in enumerate(MU):
-            members = [x for i, x in enumerate(X) if C[i] == j]
-            MU[j] = centroid(members)
+                c = C[i]
+                C[i], U[i], L[i] = _two_closest(x, MU, distance)
+                computed += k
+                if c != C[i]:
+                    changed += 1
+        assigned = time.time()
 
-        done = has_converged(MU, old)
+        old = MU
+        MU = update_centroids(X, C, MU)
+
+        shift = _shift(old, MU)
+        done = (changed <= max_changed or shift <= threshold or
+                iterations >= max_iter)
+
+        delta = [] if done else [distance(a, b) for a, b in izip(old, MU)]
+        if any(delta):
+            # each lower bound shrinks by the largest move of another centroid
+            order = sorted(xrange(k), key=lambda j: delta[j], reverse=True)
+            first = order[0]
+            second = delta[order[1]] if k > 1 else 0.
+            for i in xrange(n):
+                U[i] += delta[C[i]]
+                L[i] -= second if C[i] == first else delta[first]
 
         if calc_hook:
             calc_hook(MU, C, iterations)
+        if stats_hook:
+            stats_hook(_iteration_stats(computed, n * k - computed, changed,
+                                        shift, None, started, assigned))
 
     return MU, C, iterations
 
 
+ALGORITHMS = {
+    'lloyd': lloyds_algorithm,
+    'elkan': elkan_algorithm,
+    'hamerly': hamerly_algorithm,
+}
+
+
+# -----------------------------------------------------------------------------
+# Gap statistic jobs
+#
+# Each (k, sample) clustering is an independent job.  The points are handed to
+# every worker process once, when it starts, instead of with every job.
+# Sample -1 clusters the points themselves, the others cluster a uniform
+# reference dataset drawn from the bounds of the points.
+# -----------------------------------------------------------------------------
+
+_gap_state = {}
+
+
+def _init_gap_worker(X, distance_fn, n_init):
+    from hew.structures.vector import bounds
+
+    _gap_state['X'] = X
+    _gap_state['distance_fn'] = distance_fn
+    _gap_state['n_init'] = n_init
+    _gap_state['bounds'] = bounds(X)
+
+
+def _gap_job(job):
+    """ Returns the log of Wk for one clustering """
+    from hew.structures.monte_carlo import MonteCarlo
+    import math
+
+    k, sample, seed = job
+    X = _gap_state['X']
+    distance_fn = _gap_state['distance_fn']
+
+    if sample < 0:
+        c = KMeans(k, X, distance_fn, True, n_init=_gap_state['n_init'],
+                   random_state=seed, workers=1)
+    else:
+        B = list(MonteCarlo(*_gap_state['bounds']).xrange(
+            len(X), random.Random(seed)))
+        c = KMeans(k, B, distance_fn, random_state=seed)
+    return k, sample, math.log(c.Wk)
+
+
 # https://datasciencelab.wordpress.com/2013/12/27/finding-the-k-in-k-means-clustering/
-def optimal_clusters(X, distance_fn, max_k=10, samples=10):
+def optimal_clusters(X, distance_fn, max_k=10, samples=10, workers=None,
+                     random_state=None, early_stop=False, progress=None,
+                     n_init=1):
     """ `X` is the input array of points to test
     `max_k` is the maximum number of clusters to test for
     `samples` is the number of monte carlo simulations to run at each step
+    `workers` is the number of processes to use, all cores by default
+    `random_state` seeds every clustering, so the result is reproducible
+    `early_stop` if True, stops at the first k that meets the gap criterion
+        instead of testing every k up to `max_k`
+    `progress` if provided, is called with (k, max_k) as each k completes
+    `n_init` is the number of runs that cluster `X` itself at each k, the
+        lowest Wk is kept
     """
     from hew.structures.running_statistics import RunningStatistics
-    from hew.structures.monte_carlo import MonteCarlo
-    from hew.structures.vector import bounds
     import math
+    import multiprocessing
+
+    if random_state is None:
+        random_state = random.randrange(1 << 31)
 
-    mins, maxs = bounds(X)
-    B_Generator = MonteCarlo(mins, maxs)
-    nX = len(X)
+    jobs = [(k, sample, '{0}:{1}:{2}'.format(random_state, k, sample))
+            for k in range(1, max_k + 1)
+            for sample in range(-1, samples)]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, _init_gap_worker,
+                                    (X, distance_fn, n_init))
+        results = pool.imap(_gap_job, jobs)
+    else:
+        _init_gap_worker(X, distance_fn, n_init)
+        results = (_gap_job(job) for job in jobs)
 
     # arrays that include max_k
     Gap = [0.] * (max_k + 1)
@@ -141,81 +727,253 @@ def optimal_clusters(X, distance_fn, max_k=10, samples=10):
     WK0 = [0.] * (max_k + 1)
     WKB = [0.] * (max_k + 1)
 
-    sys.stderr.write('Checking for optimal cluster size\n')
-
-    for k in range(1, max_k + 1):
-        c = KMeans(k, X, distance_fn, True)
-        sys.stderr.write('{0} '.format(k))
-        sys.stderr.flush()
-
+    opt_k = None
+    try:
         s = RunningStatistics()
-        for _ in range(samples):
-            B = list(B_Generator.xrange(nX))
-            b = KMeans(k, B, distance_fn)
-            s += math.log(b.Wk)
+        for k, sample, log_wk in results:
+            if sample < 0:
+                WK0[k] = log_wk
+            else:
+                s += log_wk
+            if sample < samples - 1:
+                continue
 
-        WK0[k] = math.log(c.Wk)
-        WKB[k] = s.mean
-        SSD[k] = s.standard_deviation * math.sqrt(1 + 1/s.count)
-        Gap[k] = s.mean - WK0[k]
+            WKB[k] = s.mean
+            SSD[k] = s.standard_deviation * math.sqrt(1 + 1. / s.count)
+            Gap[k] = s.mean - WK0[k]
+            s = RunningStatistics()
 
-    sys.stderr.write('\n')
+            if progress:
+                progress(k, max_k)
 
-    opt_k = None
-    for k in range(1, max_k - 1):
-        nextOne = Gap[k+1] - SSD[k+1]
-        delta = Gap[k] - nextOne
-        if delta > 0 and not opt_k:
-            opt_k = k
+            # the criterion for k needs the results for k + 1
+            prev = k - 1
+            if 1 <= prev < max_k - 1 and not opt_k:
+                nextOne = Gap[k] - SSD[k]
+                delta = Gap[prev] - nextOne
+                if delta > 0:
+                    opt_k = prev
+                    if early_stop:
+                        break
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        _gap_state.clear()
 
     return opt_k
 
+
+# -----------------------------------------------------------------------------
+# Restarts
+#
+# Every run is seeded from its own string, so a run gives the same clustering
+# in any worker process and in any order.
 # -----------------------------------------------------------------------------
 
+_restart_state = {}
+
+
+def _init_restart_worker(X, distance_fn):
+    _restart_state['X'] = X
+    _restart_state['distance_fn'] = distance_fn
+
+
+def _restart_job(job):
+    """ Fits one run and returns (Wk, MU, C, iterations, stats) """
+    seed, k, init, algorithm, options = job
+    X = _restart_state['X']
+    distance_fn = _restart_state['distance_fn']
+    stats = []
+    MU0 = SEEDINGS[init](X, k, distance_fn, rng=random.Random(seed))
+    MU, C, iterations = ALGORITHMS[algorithm](X, MU0, distance_fn,
+                                              stats_hook=stats.append,
+                                              **options)
+    return inertia(X, MU, C, distance_fn), MU, C, iterations, stats
+
+
+def _restarts(X, k, distance_fn, init, algorithm, options, n_init,
+              random_state, workers):
+    """ Returns the result of `_restart_job` with the lowest Wk """
+    import multiprocessing
+
+    jobs = [('{0}:{1}'.format(random_state, i), k, init, algorithm, options)
+            for i in xrange(n_init)]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, n_init)
+
+    if workers <= 1:
+        _init_restart_worker(X, distance_fn)
+        try:
+            results = [_restart_job(job) for job in jobs]
+        finally:
+            _restart_state.clear()
+    else:
+        pool = multiprocessing.Pool(workers, _init_restart_worker,
+                                    (X, distance_fn))
+        try:
+            results = pool.map(_restart_job, jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    # the first run wins a tie, so the choice does not depend on timing
+    return min(results, key=lambda r: r[0])
+
+# -----------------------------------------------------------------------------
+# Prediction and persistence
+# -----------------------------------------------------------------------------
+
+
+def _matrix(X, distance_fn):
+    """ `X` as a numpy matrix if `distance_fn` has a batched form """
+    from hew.structures.vector import as_matrix, batched_distance
+
+    if batched_distance(distance_fn):
+        return as_matrix(X)
+    return X
+
+
+def centroid_index(MU, distance_fn):
+    """ Returns a tree for finding the closest centroid, or None if
+    `distance_fn` is not known to obey the bounds the trees rely on
+    """
+    from hew.structures import vector
+    from hew.structures.kd_tree import KDTree
+    from hew.structures.vp_tree import VPTree
+
+    objects = [(tuple(mu), j) for j, mu in enumerate(MU)]
+    try:
+        return KDTree(objects, distance_fn, background=False)
+    except ValueError:
+        pass
+    if distance_fn is vector.distance_cosine_similarity:
+        return VPTree(objects, distance_fn)
+    return None
+
+
+def _describe_distance(distance_fn):
+    from hew.structures import metric, vector
+
+    if isinstance(distance_fn, metric.Metric):
+        return {'metric': type(distance_fn).__name__,
+                'weights': distance_fn.weights}
+    name = getattr(distance_fn, '__name__', None)
+    if name and getattr(vector, name, None) is distance_fn:
+        return {'function': name}
+    raise ValueError('Cannot save the distance {0}'.format(distance_fn))
+
+
+def _restore_distance(description):
+    from hew.structures import metric, vector
+
+    if 'metric' in description:
+        cls = getattr(metric, description['metric'])
+        return cls(description['weights'])
+    return getattr(vector, description['function'])
+
+# -----------------------------------------------------------------------------
+
+
+class ClusterView(object):
+    """ The points of one cluster, read through their indexes instead of
+    being copied out of the clustered points
+    """
+
+    def __init__(self, vectors, indexes):
+        self.vectors = vectors
+        self.indexes = indexes
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, i):
+        return self.vectors[self.indexes[i]]
+
+    def __iter__(self):
+        vectors = self.vectors
+        for i in self.indexes:
+            yield vectors[i]
+
 
 class KMeans(object):
     # -------------------------------------------------------------------------
     # Factory Methods
     # -------------------------------------------------------------------------
     @classmethod
-    def fromTable(cls, k, arrayOfDictionaries, vectorFields, distance_fn):
+    def fromTable(cls, k, arrayOfDictionaries, vectorFields, distance_fn,
+                  progress=None, n_init=1, random_state=None, workers=None):
         """
         Initializes a k-means instance from a tabular structure
         """
-        from hew.structures.vector import extractFloatVectors
+        from hew.structures.feature_buffer import FeatureBuffer
 
-        vectors = extractFloatVectors(arrayOfDictionaries, vectorFields)
+        buffer = FeatureBuffer.fromTable(arrayOfDictionaries, vectorFields)
+        return cls.fromBuffer(k, buffer, distance_fn, progress, n_init,
+                              random_state, workers)
 
+    @classmethod
+    def fromBuffer(cls, k, buffer, distance_fn, progress=None, n_init=1,
+                   random_state=None, workers=None):
+        """
+        Initializes a k-means instance from a `FeatureBuffer`
+        If `k` is -1, the number of clusters is found with `optimal_clusters`
+        which reports to `progress`
+        """
         if k == -1:
-            k = optimal_clusters(vectors, distance_fn, 20)
+            k = optimal_clusters(buffer, distance_fn, 20, workers=workers,
+                                 random_state=random_state, progress=progress)
 
-        return KMeans(k, vectors, distance_fn, True)
+        return KMeans(k, buffer, distance_fn, True, n_init=n_init,
+                      random_state=random_state, workers=workers)
 
     # -------------------------------------------------------------------------
     # Customization Methods
     # -------------------------------------------------------------------------
-    def __init__(self, k, vectors, distance_fn, use_kpp=False):
+    def __init__(self, k, vectors, distance_fn, use_kpp=False,
+                 algorithm='lloyd', max_iter=300, tol=0., max_changed=0,
+                 init=None, n_init=1, random_state=None, workers=None):
         """
         `k` is the number of clusters to find
         `vectors` is the array of points
         `distance_fn` a function that calculates the difference between points
         `use_kpp` if True, the initial centroids will be seeded using KMeans++
+        `algorithm` is one of 'lloyd', 'elkan' or 'hamerly'
+        `max_iter`, `tol` and `max_changed` decide when the algorithm stops
+        `init` if provided, overrides `use_kpp` with one of 'random',
+            'k-means++' or 'k-means||'
+        `n_init` is the number of runs from different seedings; the run
+            with the lowest Wk is kept
+        `random_state` seeds every run, so the result is reproducible
+        `workers` is the number of processes for the runs, all cores by
+            default
         """
         assert len(vectors) > 0
-        self.distance_fn = distance_fn
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown algorithm {0}'.format(algorithm))
+        if init is None:
+            init = 'k-means++' if use_kpp else 'random'
+        if init not in SEEDINGS:
+            raise ValueError('Unknown seeding {0}'.format(init))
+        assert n_init > 0
+        if random_state is None:
+            random_state = random.randrange(1 << 31)
 
-        # initialize cluster centers
-        if use_kpp:
-            MU0 = kmeans_plus_plus(vectors, k,  distance_fn)
-        else:
-            MU0 = random.sample(set(vectors), k)
+        self.distance_fn = distance_fn
+        self.algorithm = algorithm
+        self.random_state = random_state
 
         self.vectors = vectors
         self.k = k
         self.d = len(vectors[0])
-        self.MU, self.clusterIndex, self.iter = lloyds_algorithm(vectors, MU0,
-                                                                 distance_fn)
+        options = dict(max_iter=max_iter, tol=tol, max_changed=max_changed)
+        best = _restarts(vectors, k, distance_fn, init, algorithm, options,
+                         n_init, random_state, workers)
+        self._wk, self.MU, self.clusterIndex, self.iter, self.stats = best
         self.C = None
+        self._index = None
 
     def __len__(self):
         return len(self.clusterIndex)
@@ -225,33 +983,101 @@ class KMeans(object):
             yield c
 
     @property
-    def Wk(self):
-        """ A measure of the compactness of clustering """
-        C = self.groups
-        # coeff = [1/(2*len(C[i])) for i in xrange(self.k)]
+    def skipped(self):
+        """ The number of distance computations skipped in each iteration """
+        return [s['skipped'] for s in self.stats]
 
-        return sum([self.distance_fn(self.MU[i], c)  # * coeff[i]
-                    for i in range(self.k)
-                    for c in C[i]])
+    @property
+    def Wk(self):
+        """ A measure of the compactness of clustering, the total distance
+        from each point to its centroid, summed once when the fit finished
+        """
+        return self._wk
 
     @property
     def groups(self):
+        """ The points of each cluster, as views over `vectors` """
         if not self.C:
-            self.C = [[] for _ in xrange(self.k)]
-            for i, cluster_i in enumerate(self.clusterIndex):
-                self.C[cluster_i].append(self.vectors[i])
+            self.C = [ClusterView(self.vectors, indexes)
+                      for indexes in members(self.clusterIndex, self.k)]
         return self.C
 
+    @property
+    def index(self):
+        """ The tree over the centroids used by `predict`, or None when
+        there are too few centroids for a tree to pay off
+        """
+        if self._index is None and self.k >= INDEX_MIN_K:
+            self._index = centroid_index(self.MU, self.distance_fn)
+        return self._index
+
+    def predict(self, points):
+        """ Returns the cluster of each point in the sequence `points` """
+        if not len(points):
+            return []
+
+        index = self.index
+        if index is None:
+            C = assign_clusters(_matrix(points, self.distance_fn), self.MU,
+                                self.distance_fn)
+            return [int(c) for c in C]
+        return [index.nearest_neighbor(p)[1] for p in points]
+
+    def save(self, fileName):
+        """ Writes the centroids and the distance as JSON.
+        The distance has to be a function from `hew.structures.vector` or a
+        `Metric`.
+        """
+        import json
+
+        model = {
+            'k': self.k,
+            'd': self.d,
+            'distance': _describe_distance(self.distance_fn),
+            'centroids': [[float(v) for v in mu] for mu in self.MU],
+        }
+        with open(fileName, 'w') as f:
+            json.dump(model, f)
+
+    @classmethod
+    def load(cls, fileName):
+        """ Opens a model written by `save`.  It can `predict`, but does not
+        hold the points it was fitted on.
+        """
+        import json
+
+        with open(fileName, 'r') as f:
+            model = json.load(f)
+
+        k_means = cls.__new__(cls)
+        k_means.distance_fn = _restore_distance(model['distance'])
+        k_means.algorithm = None
+        k_means.random_state = None
+        k_means.vectors = None
+        k_means.k = model['k']
+        k_means.d = model['d']
+        k_means.MU = model['centroids']
+        k_means.clusterIndex = []
+        k_means.iter = 0
+        k_means.stats = []
+        k_means.C = None
+        k_means._wk = None
+        k_means._index = None
+        return k_means
+
     # -------------------------------------------------------------------------
     # Useful Methods
     # -------------------------------------------------------------------------
 
     @classmethod
     def run(cls, args):
-        with open(args.input, 'r') as f:
-            reader = csv.DictReader(f, dialect=csv.excel_tab)
-            out_cols = reader.fieldnames
-            data = [convertBooleanFields(row) for row in reader]
+        """ Clusters a tab delimited file in two streaming passes: the first
+        reads only the value columns into a `FeatureBuffer`, the second
+        copies every row to the output with its cluster appended
+        """
+        from hew.structures.feature_buffer import FeatureBuffer
+
+        buffer = FeatureBuffer.fromFile(args.input, args.fields)
 
         distance_fn = None
         if args.distance == 'euclid':
@@ -261,26 +1087,170 @@ class KMeans(object):
             from hew.structures.vector import distance_cosine_similarity
             distance_fn = distance_cosine_similarity
 
-        k_means = KMeans.fromTable(args.clusters, data, args.fields,
-                                   distance_fn)
+        k = args.clusters
+        if k == -1:
+            k = optimal_clusters(buffer, distance_fn, 20, workers=args.workers,
+                                 random_state=args.seed,
+                                 progress=stderr_progress)
+
+        if args.batch_size:
+            model = MiniBatchKMeans(k, distance_fn, args.batch_size,
+                                    args.max_iter, random_state=args.seed)
+            clusters = model.fit(buffer).labels(buffer)
+        else:
+            model = KMeans(k, buffer, distance_fn, True,
+                           max_iter=args.max_iter, n_init=args.n_init,
+                           random_state=args.seed, workers=args.workers)
+            clusters = iter(model)
+
+        with open(args.input, 'r') as f:
+            reader = csv.reader(f, dialect=csv.excel_tab)
+            header = next(reader)
+            with open(args.outputFileName, 'w') as out:
+                writer = csv.writer(out, dialect=csv.excel_tab,
+                                    lineterminator='\n')
+                writer.writerow(header + [args.resultColumn])
+                # DictReader skips blank lines, so they have no cluster
+                rows = (row for row in reader if row)
+                labeled = (row + [str(int(c) + 1)]
+                           for row, c in izip(rows, clusters))
+                for chunk in _chunks(labeled, OUTPUT_ROWS):
+                    writer.writerows(chunk)
+
+# -----------------------------------------------------------------------------
+# Adapted from
+# https://www.eecs.tufts.edu/~dsculley/papers/fastkmeans.pdf
+# -----------------------------------------------------------------------------
+
+
+def _chunks(source, size):
+    """ Generates lists of up to `size` items from any iterable """
+    it = iter(source)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
 
-        with open(args.outputFileName, 'w') as f:
-            cells = list(out_cols)
-            cells.append(args.resultColumn)
-            f.write('\t'.join(cells))
-            f.write('\n')
+class MiniBatchKMeans(object):
+    """
+    k-means fitted from small batches of points, so the data never has to be
+    held in memory or visited in full on every step.
+    """
+
+    # -------------------------------------------------------------------------
+    # Customization Methods
+    # -------------------------------------------------------------------------
+    def __init__(self, k, distance_fn, batch_size=1024, max_iter=100, tol=0.,
+                 random_state=None):
+        """
+        `k` is the number of clusters to find
+        `distance_fn` a function that calculates the difference between points
+        `batch_size` is the number of points in each batch
+        `max_iter` is the most batches `fit` will sample from a sequence
+        `tol` sampling stops once no centroid moves farther than this
+        `random_state` seeds the sampling of batches
+        """
+        assert k > 0
+        assert batch_size > 0
+        self.k = k
+        self.distance_fn = distance_fn
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random = random.Random(random_state)
 
-            for orig, cluster in izip(input, k_means):
-                cells = [str(orig[x]) for x in out_cols]
-                cells.append(str(cluster + 1))
-                f.write('\t'.join(cells))
-                f.write('\n')
+        self.MU = None
+        self.counts = [0] * k
+        self.iter = 0
+
+    # -------------------------------------------------------------------------
+    # Useful Methods
+    # -------------------------------------------------------------------------
+
+    def fit(self, source):
+        """
+        `source` is either a sequence of points, like a `FeatureBuffer`
+        (which may be memory-mapped), that is sampled at random,
+        or any other iterable of points, which is read once in order
+        """
+        if hasattr(source, '__len__') and hasattr(source, '__getitem__'):
+            n = len(source)
+            size = min(self.batch_size, n)
+            for _ in xrange(self.max_iter):
+                # sorted indexes read a memory-mapped file front to back
+                indexes = sorted(self.random.sample(xrange(n), size))
+                shift = self.partial_fit([source[i] for i in indexes])
+                if shift <= self.tol:
+                    break
+        else:
+            for batch in _chunks(source, self.batch_size):
+                self.partial_fit(batch)
+        return self
+
+    def partial_fit(self, batch):
+        """
+        Moves each centroid toward the mean of its points in `batch`.
+        The learning rate of a centroid is the share of all the points it
+        has been assigned that are in this batch.
+        The first batch seeds the centroids, so it needs at least `k` points.
+
+        Returns:
+            the farthest distance moved by a centroid
+        """
+        if self.MU is None:
+            if len(batch) < self.k:
+                raise ValueError('The first batch needs at least k points')
+            self.MU = kmeans_plus_plus(batch, self.k, self.distance_fn,
+                                       self.random)
+
+        X = self._matrix(batch)
+        C = assign_clusters(X, self.MU, self.distance_fn)
+        means = update_centroids(X, C, self.MU)
+
+        batch_counts = [0] * self.k
+        for j in C:
+            batch_counts[j] += 1
+
+        shift = 0.
+        for j, m in enumerate(batch_counts):
+            if not m:
+                continue
+            self.counts[j] += m
+            eta = m / float(self.counts[j])
+            old = self.MU[j]
+            self.MU[j] = [a + eta * (b - a) for a, b in izip(old, means[j])]
+            shift = max(shift, self.distance_fn(old, self.MU[j]))
+
+        self.iter += 1
+        return shift
+
+    def labels(self, source):
+        """ Generates the cluster of each point, reading `source` once """
+        for batch in _chunks(source, self.batch_size):
+            for c in assign_clusters(self._matrix(batch), self.MU,
+                                     self.distance_fn):
+                yield int(c)
+
+    def _matrix(self, batch):
+        return _matrix(batch, self.distance_fn)
 
 # -----------------------------------------------------------------------------
 # Main
 # -----------------------------------------------------------------------------
 
 
+def stderr_progress(k, max_k):
+    """ Reports the progress of `optimal_clusters` on the console """
+    if k == 1:
+        sys.stderr.write('Checking for optimal cluster size\n')
+    sys.stderr.write('{0} '.format(k))
+    if k == max_k:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+
 def buildArgParser():
     description = 'Determine clusters from a table of features'
     p = argparse.ArgumentParser(description=description)
@@ -297,6 +1267,16 @@ def buildArgParser():
     p.add_argument('-d', '--distance',
                    default='euclid', choices=['euclid', 'cosine'],
                    help='the distance measurement to use')
+    p.add_argument('--workers', type=int, default=None,
+                   help='the number of processes to use, all cores by default')
+    p.add_argument('--seed', type=int, default=None,
+                   help='seeds the clustering, so it can be repeated')
+    p.add_argument('--max-iter', dest='max_iter', type=int, default=300,
+                   help='the most iterations, or batches with --batch-size')
+    p.add_argument('--n-init', dest='n_init', type=int, default=1,
+                   help='the number of runs to keep the best of')
+    p.add_argument('--batch-size', dest='batch_size', type=int, default=0,
+                   help='fit with mini-batch k-means using batches this size')
     p.add_argument('fields', metavar='fields', nargs='+',
                    help='the value columns')
     return p
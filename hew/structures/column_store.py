@@ -0,0 +1,170 @@
+import sys
+from array import array
+from hew.structures.feature_buffer import parse_float
+
+if sys.version >= '3':
+    xrange = range
+
+# the fewest distinct values for a column to be detected as numeric
+NUMERIC_MIN_VALUES = 10
+
+
+def _numbers(values):
+    """ Returns `values` as floats, or None if any of them is not a number """
+    result = []
+    for v in values:
+        try:
+            x = parse_float(v)
+        except (ValueError, TypeError, AttributeError):
+            return None
+        if x is None:
+            return None
+        result.append(x)
+    return result
+
+
+class ColumnStore(object):
+    """
+    The columns of a table, each dictionary-encoded: every distinct value is
+    kept once in `values`, and each row holds its small integer code in an
+    `array('i')`.  Codes are given in order of first appearance.
+    A numeric column also keeps the value of each row as a float in `numbers`.
+    The store is not changed once it is built, so any number of views over
+    subsets of its rows can share it.
+    """
+
+    # -------------------------------------------------------------------------
+    # Factory Methods
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fromColumns(cls, dictionaryOfLists, numeric=None):
+        """ Encodes a dictionary of equally long lists
+        `numeric` names the numeric columns.  If None, a column is numeric
+            when all of its values, of which there are at least
+            `NUMERIC_MIN_VALUES`, are numbers.
+        """
+        store = cls()
+        for name, column in dictionaryOfLists.items():
+            store.add_column(name, column)
+        store.detect_numeric(numeric)
+        return store
+
+    @classmethod
+    def fromRows(cls, rows, numeric=None):
+        """ Encodes any iterable of dictionaries one row at a time, so the
+        rows need not be held in memory.  The columns are those of the first
+        row; a column missing from a later row holds None.
+        `numeric` is as in `fromColumns`
+        """
+        store = cls()
+        for row in rows:
+            store.append(row)
+        store.detect_numeric(numeric)
+        return store
+
+    # -------------------------------------------------------------------------
+    # Customization Methods
+    # -------------------------------------------------------------------------
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+        self.values = {}
+        self.lookup = {}
+        self.numbers = {}
+
+    def __len__(self):
+        if not self.names:
+            return 0
+        return len(self.codes[self.names[0]])
+
+    def __contains__(self, name):
+        return name in self.codes
+
+    # -------------------------------------------------------------------------
+    # Loading
+    # -------------------------------------------------------------------------
+
+    def _start(self, name):
+        self.names.append(name)
+        self.codes[name] = array('i')
+        self.values[name] = []
+        self.lookup[name] = {}
+
+    def add_column(self, name, column):
+        self._start(name)
+        codes = self.codes[name]
+        values = self.values[name]
+        lookup = self.lookup[name]
+        for v in column:
+            code = lookup.get(v)
+            if code is None:
+                code = lookup[v] = len(values)
+                values.append(v)
+            codes.append(code)
+
+    def append(self, row):
+        """ Encodes dictionary `row` at the end of every column.  The first
+        row names the columns.
+        """
+        if not self.names:
+            for name in row:
+                self._start(name)
+
+        for name in self.names:
+            v = row.get(name)
+            lookup = self.lookup[name]
+            code = lookup.get(v)
+            if code is None:
+                values = self.values[name]
+                code = lookup[v] = len(values)
+                values.append(v)
+            self.codes[name].append(code)
+
+    def add_numbers(self, name):
+        """ Keeps the values of column `name` as floats
+        Raises a ValueError if any of them is not a number
+        """
+        parsed = _numbers(self.values[name])
+        if parsed is None:
+            raise ValueError('Column {0} is not numeric'.format(name))
+        self.numbers[name] = array('d', [parsed[c] for c in self.codes[name]])
+
+    def detect_numeric(self, numeric=None):
+        """ Adds the numbers of the columns named in `numeric`, or of every
+        column that looks numeric if `numeric` is None
+        """
+        if numeric is not None:
+            for name in numeric:
+                self.add_numbers(name)
+            return
+
+        for name in self.names:
+            values = self.values[name]
+            if len(values) >= NUMERIC_MIN_VALUES and _numbers(values):
+                self.add_numbers(name)
+
+    # -------------------------------------------------------------------------
+    # Access
+    # -------------------------------------------------------------------------
+
+    def encode(self, name, v):
+        """ The code of value `v` in column `name`, or None if it never
+        occurs
+        """
+        return self.lookup[name].get(v)
+
+    def decode(self, name, code):
+        return self.values[name][code]
+
+    def column(self, name, indexes=None):
+        """ The values of column `name` for the rows at `indexes`, or for
+        every row
+        """
+        codes = self.codes[name]
+        values = self.values[name]
+        if indexes is None:
+            return [values[c] for c in codes]
+        return [values[codes[i]] for i in indexes]
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,219 @@
+import csv
+import sys
+from array import array
+
+if sys.version >= '3':
+    xrange = range
+
+# -----------------------------------------------------------------------------
+# Policies for a feature that is absent, None or blank
+# -----------------------------------------------------------------------------
+
+SKIP = 'skip'
+RAISE = 'raise'
+
+
+def parse_float(v):
+    """ Converts a cell to a float, accepting the booleans used in the tables
+    Returns None if the cell is missing
+    """
+    if v is None:
+        return None
+    if isinstance(v, float):
+        return v
+    if isinstance(v, (int, bool)):
+        return float(v)
+
+    v = v.strip()
+    if not v:
+        return None
+    lowered = v.lower()
+    if lowered == 'true':
+        return 1.
+    if lowered == 'false':
+        return 0.
+    return float(v)
+
+
+def _frombytes(data, raw):
+    if hasattr(data, 'frombytes'):
+        data.frombytes(raw)
+    else:  # python2.x
+        data.fromstring(raw)
+
+
+def _tobytes(data):
+    if hasattr(data, 'tobytes'):
+        return data.tobytes()
+    return data.tostring()  # python2.x
+
+
+def _map(fileName):
+    """ Returns the doubles of a file written by `FeatureBuffer.save`,
+    read from disk as they are accessed
+    """
+    import mmap
+
+    with open(fileName, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast('d')
+
+# -----------------------------------------------------------------------------
+
+
+class FeatureBuffer(object):
+    """
+    The numeric fields of a table, held row-major in a single `array('d')`.
+    Rows are streamed in one at a time, so no intermediate list of rows is
+    built.  Indexing returns a row as a tuple of floats, which lets the buffer
+    stand in for an array of vectors.
+    """
+
+    # -------------------------------------------------------------------------
+    # Factory Methods
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fromTable(cls, arrayOfDictionaries, fields, labelFields=None,
+                  missing=0.):
+        """ Loads the rows of any iterable of dictionaries """
+        buffer = cls(fields, labelFields, missing)
+        buffer.extend(arrayOfDictionaries)
+        return buffer
+
+    @classmethod
+    def fromFile(cls, fileName, fields, labelFields=None, missing=0.,
+                 dialect=csv.excel_tab):
+        """ Streams the rows of a delimited text file """
+        with open(fileName, 'r') as f:
+            reader = csv.DictReader(f, dialect=dialect)
+            return cls.fromTable(reader, fields, labelFields, missing)
+
+    @classmethod
+    def load(cls, fileName, fields, mmap=True):
+        """ Opens a file written by `save`.  With `mmap`, the rows are read
+        from disk as they are accessed instead of being loaded into memory.
+        Python 2 cannot view a mapped file as doubles, so it always loads it.
+        """
+        buffer = cls(fields)
+        if mmap and hasattr(memoryview, 'cast'):
+            buffer.data = _map(fileName)
+            buffer.mapped = fileName
+        else:
+            with open(fileName, 'rb') as f:
+                _frombytes(buffer.data, f.read())
+        return buffer
+
+    # -------------------------------------------------------------------------
+    # Customization Methods
+    # -------------------------------------------------------------------------
+    def __init__(self, fields, labelFields=None, missing=0.):
+        """
+        `fields` are the columns that hold the vector
+        `labelFields` are columns kept alongside the vector as strings
+        `missing` is the value used for a missing feature, or
+            `SKIP` to leave the row out, or
+            `RAISE` to raise a ValueError
+        """
+        assert len(fields) > 0
+        assert missing in (SKIP, RAISE) or isinstance(missing, (int, float))
+
+        self.fields = list(fields)
+        self.labelFields = list(labelFields or [])
+        self.d = len(self.fields)
+        self.missing = missing
+        self.skipped = 0
+
+        self.data = array('d')
+        self.labels = [[] for _ in self.labelFields]
+        # the file `data` is mapped from, see `load`
+        self.mapped = None
+
+    def __len__(self):
+        return len(self.data) // self.d
+
+    def __getstate__(self):
+        """ A mapped buffer is pickled as the name of its file, which is
+        mapped again when it is unpickled
+        """
+        state = self.__dict__.copy()
+        if self.mapped:
+            state['data'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.mapped:
+            self.data = _map(self.mapped)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('FeatureBuffer index out of range')
+        start = i * self.d
+        return tuple(self.data[start:start + self.d])
+
+    def __iter__(self):
+        data = self.data
+        d = self.d
+        for start in xrange(0, len(data), d):
+            yield tuple(data[start:start + d])
+
+    # -------------------------------------------------------------------------
+    # Loading
+    # -------------------------------------------------------------------------
+
+    def append(self, row):
+        """ Adds the features of dictionary `row`
+        Returns False if the row was skipped
+        """
+        vector = []
+        for f in self.fields:
+            v = parse_float(row.get(f))
+            if v is None:
+                if self.missing == SKIP:
+                    self.skipped += 1
+                    return False
+                if self.missing == RAISE:
+                    raise ValueError('Row {0} is missing {1}'.format(
+                        len(self) + self.skipped + 1, f))
+                v = float(self.missing)
+            vector.append(v)
+
+        self.data.extend(vector)
+        for column, f in zip(self.labels, self.labelFields):
+            v = row.get(f)
+            column.append(v if v is not None else '')
+        return True
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def save(self, fileName):
+        """ Writes the vectors as raw doubles; the labels are not saved """
+        with open(fileName, 'wb') as f:
+            f.write(_tobytes(self.data))
+
+    # -------------------------------------------------------------------------
+    # Access
+    # -------------------------------------------------------------------------
+
+    def column(self, j):
+        """ The values of field `j` as an array """
+        column = self.data[j::self.d]
+        if self.mapped:
+            column = array('d', column)
+        return column
+
+    def label(self, i):
+        """ The label fields of row `i` """
+        return [column[i] for column in self.labels]
+
+    def pairs(self):
+        """ Generates (vector, label) tuples """
+        for i, x in enumerate(self):
+            yield x, self.label(i)
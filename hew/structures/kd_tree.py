@@ -1,59 +1,94 @@
 import collections
-import math
-from hew.structures.vector import distance_euclid_squared as distance_fn
+import heapq
+import threading
+from hew.structures.metric import metric_for
 
 # -----------------------------------------------------------------------------
-# Adapted from: 
+# Adapted from:
 # http://code.activestate.com/recipes/577497-kd-tree-for-nearest-neighbor-search-in-a-k-dimensi/
 # -----------------------------------------------------------------------------
 
-KDNode = collections.namedtuple("KDNode", 'point axis label left right')
+# `size` counts every node in the subtree, including tombstones
+KDNode = collections.namedtuple("KDNode",
+                                'point axis label left right size deleted')
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _hashable(label):
+    """ Labels built by `fromTable` are lists, which cannot be keys """
+    return tuple(label) if isinstance(label, list) else label
+
 
 class KDTree(object):
-    """A tree for nearest neighbor search in a k-dimensional space."""
+    """A tree for nearest neighbor search in a k-dimensional space.
+
+    Points can be added and removed after the tree is built.  Nodes are never
+    modified in place; every update creates a new version of the path it
+    touches, so a query in progress keeps reading the version it started with.
+    """
 
     # -------------------------------------------------------------------------
     # Initializer
     # -------------------------------------------------------------------------
-    def __init__(self, objects):
-        """`objects` is an iterable of (vector, label) tuples"""
+    def __init__(self, objects, metric=None, alpha=0.7, rebuild_threshold=0.5,
+                 background=True):
+        """`objects` is an iterable of (vector, label) tuples
+        `metric` is a `Metric` or one of the distance functions it knows,
+            squared Euclidean by default
+        `alpha` is the largest share of a subtree that one child may hold
+            before the subtree is rebuilt
+        `rebuild_threshold` is the share of removed points that triggers a
+            full rebuild
+        `background` if True, full rebuilds run on a separate thread
+        """
 
         a = list(objects)
         assert len(a) > 0
         assert len(a[0]) == 2
+        assert 0.5 <= alpha < 1
 
         self.k = len(a[0][0])
+        self.metric = metric_for(metric)
+        self.alpha = alpha
+        self.rebuild_threshold = rebuild_threshold
+        self.background = background
 
-        def build_tree(objects, axis=0):
-
-            if not objects:
-                return None
+        self._index = {}
+        for point, label in a:
+            self._index.setdefault(_hashable(label), []).append(point)
 
-            objects.sort(key=lambda o: o[0][axis])
-            median_idx = len(objects) // 2
-            median_point, median_label = objects[median_idx]
+        self._lock = threading.RLock()
+        self._journal = None
+        self._rebuild_thread = None
+        self._live = len(a)
+        self._dead = 0
 
-            next_axis = (axis + 1) % self.k
-            return KDNode(median_point, axis, median_label,
-                        build_tree(objects[:median_idx], next_axis),
-                        build_tree(objects[median_idx + 1:], next_axis))
+        self.root = self._build(a)
 
-        self.root = build_tree(a)
+    def __len__(self):
+        return self._live
 
     # -------------------------------------------------------------------------
     # Public Methods
     # -------------------------------------------------------------------------
-    
+
     @classmethod
-    def fromTable(cls, arrayOfDictionaries, pointFields, labelFields):
+    def fromTable(cls, arrayOfDictionaries, pointFields, labelFields,
+                  metric=None):
         """ Builds a k-d tree from a tabular structure """
-        pairs = []
-        for o in arrayOfDictionaries:
-            points = [float(o[f]) if f in o else 0. for f in pointFields]
-            labels = [o[f] if f in o else '' for f in labelFields]
-            pairs.append((points, labels))
+        from hew.structures.feature_buffer import FeatureBuffer
 
-        return KDTree(pairs)
+        buffer = FeatureBuffer.fromTable(arrayOfDictionaries, pointFields,
+                                         labelFields)
+        return cls.fromBuffer(buffer, metric)
+
+    @classmethod
+    def fromBuffer(cls, buffer, metric=None):
+        """ Builds a k-d tree from a `FeatureBuffer` """
+        return KDTree(buffer.pairs(), metric)
 
     def nearest_neighbor(self, destination):
         """`destination` is a vector of length `k`
@@ -63,28 +98,323 @@ class KDTree(object):
         """
         assert len(destination) == self.k
 
+        distance = self.metric.distance
+        axis_bound = self.metric.axis_bound
+
         best = [None, None, float('inf')]
         # state of search: best point found, its label,
-        # lowest squared distance
+        # lowest distance as measured by the metric
+
+        def recursive_search(here):
+            if here is None:
+                return
+            point, axis, label, left, right, _, deleted = here
+
+            if not deleted:
+                here_sd = distance(point, destination)
+                if here_sd < best[2]:
+                    best[:] = point, label, here_sd
+
+            diff = destination[axis] - point[axis]
+            close, away = (left, right) if diff <= 0 else (right, left)
+
+            recursive_search(close)
+            if axis_bound(diff, axis) < best[2]:
+                recursive_search(away)
+
+        recursive_search(self.root)
+        return best[0], best[1], self.metric.finalize(best[2])
+
+    def nearest_neighbors(self, destination, n):
+        """`destination` is a vector of length `k`
+        `n` is the number of neighbors to find
+
+        Returns:
+            a list of (point, label, distance), closest first
+        """
+        assert len(destination) == self.k
+        assert n > 0
+
+        distance = self.metric.distance
+        axis_bound = self.metric.axis_bound
+
+        # a max-heap of the best candidates, through negated distances
+        best = []
+        worst = [float('inf')]
+        counter = [0]
 
         def recursive_search(here):
             if here is None:
                 return
-            point, axis, label, left, right = here
+            point, axis, label, left, right, _, deleted = here
 
-            here_sd = distance_fn(point, destination)
-            if here_sd < best[2]:
-                best[:] = point, label, here_sd
+            if not deleted:
+                here_d = distance(point, destination)
+                if here_d < worst[0]:
+                    counter[0] += 1
+                    item = (-here_d, counter[0], point, label)
+                    if len(best) < n:
+                        heapq.heappush(best, item)
+                    else:
+                        heapq.heapreplace(best, item)
+                    if len(best) == n:
+                        worst[0] = -best[0][0]
 
             diff = destination[axis] - point[axis]
             close, away = (left, right) if diff <= 0 else (right, left)
 
             recursive_search(close)
-            if diff ** 2 < best[2]:
+            if axis_bound(diff, axis) < worst[0]:
                 recursive_search(away)
 
         recursive_search(self.root)
-        return best[0], best[1], math.sqrt(best[2])
+        finalize = self.metric.finalize
+        return [(point, label, finalize(-d))
+                for d, _, point, label in sorted(best, reverse=True)]
+
+    def approximate_nearest_neighbor(self, destination, eps=0.,
+                                     max_visits=None):
+        """`destination` is a vector of length `k`
+        `eps` the answer may be up to `1 + eps` times farther away than the
+            true nearest neighbor
+        `max_visits` if provided, the search stops after this many nodes
+
+        Nodes are visited best-bin-first: the unexplored branch with the
+        smallest lower bound is always descended next.
+
+        Returns:
+            (closest point, closest label, distance, exact)
+            where `exact` is True if no closer point can exist
+        """
+        assert len(destination) == self.k
+        assert eps >= 0
+
+        distance = self.metric.distance
+        axis_bound = self.metric.axis_bound
+        factor = self.metric.relaxation(eps)
+
+        best_point, best_label, best_d = None, None, float('inf')
+        visits = 0
+        counter = 0
+        skipped = float('inf')
+
+        heap = [(0., counter, self.root)]
+        while heap:
+            bound, _, node = heapq.heappop(heap)
+            if bound * factor >= best_d:
+                skipped = bound
+                break
+
+            while node is not None:
+                if max_visits is not None and visits >= max_visits:
+                    break
+                visits += 1
+
+                point, axis, label, left, right, _, deleted = node
+                if not deleted:
+                    here_d = distance(point, destination)
+                    if here_d < best_d:
+                        best_point, best_label, best_d = point, label, here_d
+
+                diff = destination[axis] - point[axis]
+                close, away = (left, right) if diff <= 0 else (right, left)
+
+                if away is not None:
+                    away_bound = max(bound, axis_bound(diff, axis))
+                    if away_bound * factor < best_d:
+                        counter += 1
+                        heapq.heappush(heap, (away_bound, counter, away))
+                    else:
+                        skipped = min(skipped, away_bound)
+                node = close
+
+            if node is not None:
+                skipped = min(skipped, bound)
+                break
+
+        # a skipped branch could only hold a closer point if its bound is
+        # below the best distance found
+        if heap:
+            skipped = min(skipped, heap[0][0])
+        exact = skipped >= best_d
+
+        return (best_point, best_label, self.metric.finalize(best_d), exact)
+
+    def insert(self, point, label):
+        """ Adds `point` to the tree, rebuilding the highest subtree on its
+        path that becomes unbalanced
+        """
+        assert len(point) == self.k
+
+        with self._lock:
+            self.root = self._insert(self.root, point, label)
+            self._index.setdefault(_hashable(label), []).append(point)
+            self._live += 1
+            if self._journal is not None:
+                self._journal.append((True, point, label))
+
+    def remove(self, label):
+        """ Marks every point carrying `label` as deleted
+
+        Returns:
+            the number of points removed
+        """
+        with self._lock:
+            points = self._index.pop(_hashable(label), None)
+            if not points:
+                return 0
+
+            root = self.root
+            for point in points:
+                root = self._delete(root, point, label)
+                if self._journal is not None:
+                    self._journal.append((False, point, label))
+            self.root = root
+
+            self._live -= len(points)
+            self._dead += len(points)
+            if self._dead > self.rebuild_threshold * (self._live + self._dead):
+                self.rebuild(self.background)
+
+            return len(points)
+
+    def rebuild(self, background=False):
+        """ Rebuilds the whole tree without the removed points.
+        In the background, queries and updates are served by the current
+        version until the new one is swapped in.
+        """
+        with self._lock:
+            if self._journal is not None:
+                return
+
+            if not background:
+                self.root = self._build(self._collect(self.root))
+                self._dead = 0
+                return
+
+            self._journal = []
+            t = threading.Thread(target=self._background_rebuild,
+                                 args=(self.root,))
+            t.daemon = True
+            self._rebuild_thread = t
+            t.start()
+
+    def wait_for_rebuild(self):
+        """ Blocks until a background rebuild, if any, has been swapped in """
+        t = self._rebuild_thread
+        if t:
+            t.join()
+
+    # -------------------------------------------------------------------------
+    # Tree Maintenance
+    # -------------------------------------------------------------------------
+
+    def _build(self, objects, axis=0):
+        if not objects:
+            return None
+
+        objects.sort(key=lambda o: o[0][axis])
+        median_idx = len(objects) // 2
+        median_point, median_label = objects[median_idx]
+
+        next_axis = (axis + 1) % self.k
+        left = self._build(objects[:median_idx], next_axis)
+        right = self._build(objects[median_idx + 1:], next_axis)
+        return KDNode(median_point, axis, median_label, left, right,
+                      1 + _size(left) + _size(right), False)
+
+    def _collect(self, node):
+        """ Returns the (point, label) pairs that have not been removed """
+        result = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if not node.deleted:
+                result.append((node.point, node.label))
+            stack.append(node.left)
+            stack.append(node.right)
+        return result
+
+    def _replace_path(self, path, child):
+        """ Copies the (node, went_left) `path` bottom-up to lead to `child`
+        """
+        for node, went_left in reversed(path):
+            old = node.left if went_left else node.right
+            size = node.size - _size(old) + _size(child)
+            if went_left:
+                child = node._replace(left=child, size=size)
+            else:
+                child = node._replace(right=child, size=size)
+        return child
+
+    def _insert(self, root, point, label):
+        path = []
+        scapegoat = None
+        node = root
+        while node is not None:
+            went_left = point[node.axis] < node.point[node.axis]
+            child = node.left if went_left else node.right
+            other = node.right if went_left else node.left
+            heavier = max(_size(child) + 1, _size(other))
+            if scapegoat is None and heavier > self.alpha * (node.size + 1):
+                scapegoat = len(path)
+            path.append((node, went_left))
+            node = child
+
+        if scapegoat is not None:
+            node = path[scapegoat][0]
+            objects = self._collect(node)
+            self._dead -= node.size - len(objects)
+            objects.append((point, label))
+            return self._replace_path(path[:scapegoat],
+                                      self._build(objects, node.axis))
+
+        axis = (path[-1][0].axis + 1) % self.k if path else 0
+        leaf = KDNode(point, axis, label, None, None, 1, False)
+        return self._replace_path(path, leaf)
+
+    def _find(self, node, point, label, path):
+        """ Returns the path to, and the live node holding `point` """
+        if node is None:
+            return None
+        if (node.point is point and not node.deleted and
+                _hashable(node.label) == _hashable(label)):
+            return path, node
+
+        diff = point[node.axis] - node.point[node.axis]
+        if diff <= 0:
+            found = self._find(node.left, point, label,
+                               path + [(node, True)])
+            if found:
+                return found
+        if diff >= 0:
+            return self._find(node.right, point, label,
+                              path + [(node, False)])
+        return None
+
+    def _delete(self, root, point, label):
+        found = self._find(root, point, label, [])
+        if not found:
+            return root
+        path, node = found
+        return self._replace_path(path, node._replace(deleted=True))
+
+    def _background_rebuild(self, snapshot):
+        fresh = self._build(self._collect(snapshot))
+
+        with self._lock:
+            dead = 0
+            for inserted, point, label in self._journal:
+                if inserted:
+                    fresh = self._insert(fresh, point, label)
+                else:
+                    fresh = self._delete(fresh, point, label)
+                    dead += 1
+            self.root = fresh
+            self._dead = dead
+            self._journal = None
 
 if __name__ == '__main__':
     pass
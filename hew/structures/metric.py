@@ -0,0 +1,145 @@
+import math
+from operator import mul, sub
+
+# -----------------------------------------------------------------------------
+# A metric pairs the distance between two points with a lower bound on that
+# distance taken from a single axis.  Space partitioning trees use the bound
+# to decide whether the far side of a split can hold a closer point.
+#
+# The distance methods avoid a Python level loop by chaining `map` over the
+# builtin operators, which keeps the per-coordinate work in C.
+# -----------------------------------------------------------------------------
+
+
+class Metric(object):
+    """ Base class for the distances that can be used to search a tree """
+
+    def __init__(self, weights=None):
+        """ `weights` if provided, scales the contribution of each axis """
+        self.weights = list(weights) if weights else None
+
+    def __call__(self, a, b):
+        return self.distance(a, b)
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and
+                self.weights == other.weights)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __repr__(self):
+        if self.weights:
+            return '{0}({1})'.format(type(self).__name__, self.weights)
+        return '{0}()'.format(type(self).__name__)
+
+    def distance(self, a, b):
+        """ The distance between points `a` and `b` """
+        raise NotImplementedError
+
+    def axis_bound(self, diff, axis):
+        """ The smallest distance to a point that is `diff` away along `axis`
+        """
+        raise NotImplementedError
+
+    def finalize(self, d):
+        """ Converts a value from `distance` into the reported distance """
+        return d
+
+    def relaxation(self, eps):
+        """ The factor that scales a value from `distance` by `1 + eps` once
+        it is reported
+        """
+        return 1. + eps
+
+    def true_distance(self, a, b):
+        """ The reported distance between points `a` and `b` """
+        return self.finalize(self.distance(a, b))
+
+
+class EuclideanSquared(Metric):
+    """ Squared Euclidean distance, reported as the Euclidean distance """
+
+    def distance(self, a, b):
+        d = list(map(sub, a, b))
+        if self.weights:
+            return sum(map(mul, self.weights, map(mul, d, d)))
+        return sum(map(mul, d, d))
+
+    def axis_bound(self, diff, axis):
+        if self.weights:
+            return self.weights[axis] * diff * diff
+        return diff * diff
+
+    def finalize(self, d):
+        return math.sqrt(d)
+
+    def relaxation(self, eps):
+        return (1. + eps) ** 2
+
+
+class Manhattan(Metric):
+    """ Sum of the absolute differences along each axis """
+
+    def distance(self, a, b):
+        if self.weights:
+            return sum(map(mul, self.weights, map(abs, map(sub, a, b))))
+        return sum(map(abs, map(sub, a, b)))
+
+    def axis_bound(self, diff, axis):
+        if self.weights:
+            return self.weights[axis] * abs(diff)
+        return abs(diff)
+
+
+class Chebyshev(Metric):
+    """ Largest absolute difference along any axis """
+
+    def distance(self, a, b):
+        if self.weights:
+            return max(map(mul, self.weights, map(abs, map(sub, a, b))))
+        return max(map(abs, map(sub, a, b)))
+
+    def axis_bound(self, diff, axis):
+        if self.weights:
+            return self.weights[axis] * abs(diff)
+        return abs(diff)
+
+# -----------------------------------------------------------------------------
+
+
+def metric_for(distance):
+    """ Returns the `Metric` for a distance function from
+    `hew.structures.vector`, or `distance` itself, if it is already a `Metric`
+    """
+    from hew.structures import vector
+
+    if distance is None:
+        return EuclideanSquared()
+    if isinstance(distance, Metric):
+        return distance
+
+    known = {
+        vector.distance_euclid_squared: EuclideanSquared,
+        vector.distance_manhattan: Manhattan,
+        vector.distance_chebyshev: Chebyshev,
+    }
+    if distance not in known:
+        raise ValueError('No axis bound is known for {0}'.format(distance))
+    return known[distance]()
+
+
+def metric_distance(distance):
+    """ Returns a version of `distance` that obeys the triangle inequality,
+    as needed by metric trees and bound-based clustering
+    """
+    from hew.structures import vector
+
+    if distance is None or distance is vector.distance_euclid_squared:
+        distance = EuclideanSquared()
+    if isinstance(distance, Metric):
+        return distance.true_distance
+    return distance
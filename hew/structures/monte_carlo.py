@@ -1,4 +1,5 @@
 import sys
+import random
 if sys.version >= '3':
     xrange = range
 
@@ -19,9 +20,10 @@ class MonteCarlo(object):
         self.mins = list(mins)
         self.maxs = list(maxs)
 
-    def xrange(self, N):
-        import random
-
+    def xrange(self, N, rng=random):
+        """ Generates _N_ points drawn uniformly from the bounds, with _rng_,
+            a `random.Random` or the module itself.
+        """
         for _ in xrange(N):
-            yield tuple([random.uniform(self.mins[d], self.maxs[d])
+            yield tuple([rng.uniform(self.mins[d], self.maxs[d])
                          for d in range(self.dim)])
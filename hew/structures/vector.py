@@ -3,17 +3,20 @@ try:
 except ImportError:  # python3.x
     izip = zip
 
+try:
+    import numpy
+except ImportError:  # numpy is optional
+    numpy = None
+
 
 # -----------------------------------------------------------------------------
 
-def extractFloatVectors(arrayOfDictionaries, vectorFields):
-    """ Return the numeric fields from a dataset """
-    vectors = []
-    for o in arrayOfDictionaries:
-        vectors.append(tuple([float(o[f])
-                              if f in o else 0.
-                              for f in vectorFields]))
-    return vectors
+def extractFloatVectors(arrayOfDictionaries, vectorFields, missing=0.):
+    """ Return the numeric fields from a dataset as a `FeatureBuffer` """
+    from hew.structures.feature_buffer import FeatureBuffer
+
+    return FeatureBuffer.fromTable(arrayOfDictionaries, vectorFields,
+                                   missing=missing)
 
 # -----------------------------------------------------------------------------
 
@@ -46,6 +49,18 @@ def centroid(vectors):
     return c
 
 
+def distance_chebyshev(a, b):
+    """ Calculates the Chebyshev distance between two vectors"""
+    from math import fabs
+
+    s = 0
+    for x, y in izip(a, b):
+        d = fabs(x - y)
+        if d > s:
+            s = d
+    return s
+
+
 def distance_cosine_similarity(a, b):
     """ Calculates the Ochini coefficient between two vectors"""
     from math import acos
@@ -92,3 +107,67 @@ def length(a):
     for x in a:
         s += x * x
     return sqrt(s)
+
+# -----------------------------------------------------------------------------
+# Batched distances
+#
+# These need numpy.  Each takes an (n, d) matrix of points and a (k, d)
+# matrix of centroids and returns the (n, k) matrix of distances.
+# -----------------------------------------------------------------------------
+
+
+def as_matrix(vectors):
+    """ Returns `vectors` as an (n, d) numpy array.  The array shares memory
+    with a `FeatureBuffer` instead of copying it.
+    """
+    from hew.structures.feature_buffer import FeatureBuffer
+
+    if isinstance(vectors, numpy.ndarray):
+        return vectors
+    if isinstance(vectors, FeatureBuffer):
+        return numpy.frombuffer(vectors.data,
+                                dtype=numpy.float64).reshape(-1, vectors.d)
+    return numpy.asarray(vectors, dtype=numpy.float64)
+
+
+def _batched_euclid_squared(X, MU):
+    diff = X[:, None, :] - MU[None, :, :]
+    diff *= diff
+    return diff.sum(axis=2)
+
+
+def _batched_manhattan(X, MU):
+    diff = X[:, None, :] - MU[None, :, :]
+    numpy.abs(diff, out=diff)
+    return diff.sum(axis=2)
+
+
+def _batched_chebyshev(X, MU):
+    diff = X[:, None, :] - MU[None, :, :]
+    numpy.abs(diff, out=diff)
+    return diff.max(axis=2)
+
+
+def _batched_cosine_similarity(X, MU):
+    numerator = X.dot(MU.T)
+    denominator = numpy.outer(numpy.sqrt((X * X).sum(axis=1)),
+                              numpy.sqrt((MU * MU).sum(axis=1)))
+    x = numpy.zeros_like(numerator)
+    numpy.divide(numerator, denominator, out=x, where=denominator != 0)
+    numpy.clip(x, -1, 1, out=x)
+    return numpy.arccos(x)
+
+
+def batched_distance(distance_fn):
+    """ Returns the batched form of `distance_fn`, or None if there is no
+    batched form or numpy is not installed
+    """
+    if numpy is None:
+        return None
+
+    return {
+        distance_euclid_squared: _batched_euclid_squared,
+        distance_manhattan: _batched_manhattan,
+        distance_chebyshev: _batched_chebyshev,
+        distance_cosine_similarity: _batched_cosine_similarity,
+    }.get(distance_fn)
@@ -0,0 +1,146 @@
+import collections
+import heapq
+import random
+from hew.structures.metric import metric_distance
+
+# -----------------------------------------------------------------------------
+# Adapted from:
+# Yianilos, "Data structures and algorithms for nearest neighbor search in
+# general metric spaces" (1993)
+# -----------------------------------------------------------------------------
+
+# `inside` holds the points no farther than `radius` from `point`
+VPNode = collections.namedtuple("VPNode", 'point label radius inside outside')
+
+
+class VPTree(object):
+    """A vantage-point tree for nearest neighbor search in any metric space.
+
+    Unlike `KDTree` it only relies on the triangle inequality, so it can index
+    any distance from `hew.structures.vector`, including the cosine distance,
+    and it does not degrade as quickly with the number of dimensions.
+    """
+
+    # -------------------------------------------------------------------------
+    # Initializer
+    # -------------------------------------------------------------------------
+    def __init__(self, objects, distance=None, seed=0):
+        """`objects` is an iterable of (vector, label) tuples
+        `distance` is a distance function or `Metric`, Euclidean by default.
+            Squared Euclidean distances are replaced by their square root.
+        `seed` drives the choice of vantage points
+        """
+        a = list(objects)
+        assert len(a) > 0
+        assert len(a[0]) == 2
+
+        self.k = len(a[0][0])
+        self.distance = metric_distance(distance)
+        self._size = len(a)
+        self._random = random.Random(seed)
+        self.root = self._build(a)
+
+    def __len__(self):
+        return self._size
+
+    # -------------------------------------------------------------------------
+    # Public Methods
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def fromTable(cls, arrayOfDictionaries, pointFields, labelFields,
+                  distance=None):
+        """ Builds a vantage-point tree from a tabular structure """
+        from hew.structures.feature_buffer import FeatureBuffer
+
+        buffer = FeatureBuffer.fromTable(arrayOfDictionaries, pointFields,
+                                         labelFields)
+        return cls.fromBuffer(buffer, distance)
+
+    @classmethod
+    def fromBuffer(cls, buffer, distance=None):
+        """ Builds a vantage-point tree from a `FeatureBuffer` """
+        return VPTree(buffer.pairs(), distance)
+
+    def nearest_neighbor(self, destination):
+        """`destination` is a vector of length `k`
+
+        Returns:
+            (closest point, closest label, distance)
+        """
+        return self.nearest_neighbors(destination, 1)[0]
+
+    def nearest_neighbors(self, destination, n):
+        """`destination` is a vector of length `k`
+        `n` is the number of neighbors to find
+
+        Returns:
+            a list of (point, label, distance), closest first
+        """
+        assert len(destination) == self.k
+        assert n > 0
+
+        distance = self.distance
+
+        # a max-heap of the best candidates, through negated distances
+        best = []
+        tau = [float('inf')]
+        counter = [0]
+
+        def recursive_search(here):
+            if here is None:
+                return
+            point, label, radius, inside, outside = here
+
+            d = distance(point, destination)
+            if d < tau[0]:
+                counter[0] += 1
+                item = (-d, counter[0], point, label)
+                if len(best) < n:
+                    heapq.heappush(best, item)
+                else:
+                    heapq.heapreplace(best, item)
+                if len(best) == n:
+                    tau[0] = -best[0][0]
+
+            if d <= radius:
+                recursive_search(inside)
+                if d + tau[0] >= radius:
+                    recursive_search(outside)
+            else:
+                recursive_search(outside)
+                if d - tau[0] <= radius:
+                    recursive_search(inside)
+
+        recursive_search(self.root)
+        return [(point, label, -d)
+                for d, _, point, label in sorted(best, reverse=True)]
+
+    # -------------------------------------------------------------------------
+    # Tree Construction
+    # -------------------------------------------------------------------------
+
+    def _build(self, objects):
+        if not objects:
+            return None
+
+        i = self._random.randrange(len(objects))
+        objects[i], objects[-1] = objects[-1], objects[i]
+        point, label = objects.pop()
+        if not objects:
+            return VPNode(point, label, 0., None, None)
+
+        ranked = sorted([(self.distance(point, o[0]), o) for o in objects],
+                        key=lambda t: t[0])
+        median_idx = len(ranked) // 2
+        radius = ranked[median_idx][0]
+
+        inside = [o for _, o in ranked[:median_idx]]
+        outside = [o for _, o in ranked[median_idx:]]
+        del ranked
+
+        return VPNode(point, label, radius,
+                      self._build(inside), self._build(outside))
+
+if __name__ == '__main__':
+    pass
@@ -2,6 +2,11 @@ import unittest
 import sys
 import hew as sut
 
+try:
+    from cStringIO import StringIO
+except ImportError:  # python3.x
+    from io import StringIO
+
 
 class Test_C45_test(unittest.TestCase):
     def setUp(self):
@@ -40,6 +45,21 @@ class Test_C45_test(unittest.TestCase):
     def test_gain(self):
         self.assertEquals(self.target.gain('arg1', 'result'), 0)
 
+    def test_counts(self):
+        self.assertEqual(self.target.counts('arg3', 'result'),
+                         {'no': {'yes': 1, 'no': 1},
+                          'yes': {'yes': 1, 'no': 1}})
+        self.assertEqual(self.target.counts('argX', 'result'),
+                         {'x': {'yes': 2, 'no': 2}})
+
+    def test_infox_matches_partitions(self):
+        for col in ('arg1', 'arg2', 'arg3', 'argX'):
+            expected = sum(subt.flen(col) / self.target.flen(col) *
+                           subt.info('result')
+                           for subt in self.target.partitionOnFeature(col))
+            self.assertAlmostEqual(expected,
+                                   self.target.infox(col, 'result'))
+
     def test_uniques(self):
         self.assertEquals(sorted(self.target.uniques('result')), ['no', 'yes'])
         self.assertEquals(sorted(self.target.uniques('arg1')), ['left', 'right'])
@@ -108,8 +128,400 @@ class Test_C45_test(unittest.TestCase):
         self.assertEquals(actual[leftIdx].columnSet, expected[0])
         self.assertEquals(actual[rightIdx].columnSet, expected[1])
 
+    def test_partitionSharesStore(self):
+        for sub in self.target.partitionOnFeature('arg2'):
+            self.assertIs(self.target.store, sub.store)
+            self.assertEqual(sub.size(), len(sub.indexes))
+        down = self.target.buildPartition('arg2', 'down')
+        self.assertEqual(list(down.indexes), [0, 2, 3])
+        self.assertEqual(down.buildPartition('arg1', 'right').columnSet['arg3'],
+                         ['yes', 'no'])
+
+    def test_buildTree_twice(self):
+        def flatten(tree):
+            result = []
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                result.append((node.data.rule(), node.data.size()))
+                stack.extend(reversed(node.children))
+            return result
+
+        first = self.target.buildTree('result')
+        self.assertGreater(len(first.children), 0)
+        self.assertEqual(flatten(first),
+                         flatten(self.target.buildTree('result')))
+        self.assertEqual(flatten(first),
+                         flatten(self.target.buildTree('result', workers=2)))
+        self.assertEqual(4, len(self.target.columnSet['arg1']))
+        self.assertEqual(2, self.target.frequency('arg1', 'left'))
+        self.assertEqual(4., self.target.flen('arg1'))
+
+        # a split table keeps its size, but no longer its rows
+        internal = first.children[0]
+        self.assertTrue(internal.children)
+        self.assertEqual(sum(c.data.size() for c in internal.children),
+                         internal.data.size())
+        self.assertRaises(ValueError, lambda: internal.data.columnSet)
+        self.assertRaises(ValueError, internal.data.frequency, 'arg1', 'left')
+        self.assertRaises(ValueError, internal.data.get_indexes, 'arg1',
+                          'left')
+        self.assertRaises(ValueError, internal.data.flen, 'arg1')
+
+    def test_buildTree_parallel(self):
+        import random
+
+        rng = random.Random(3)
+        rows = []
+        for _ in range(600):
+            row = {'f{0}'.format(j): str(rng.randrange(2 + j))
+                   for j in range(6)}
+            row['result'] = str((int(row['f1']) + int(row['f3'])) % 3)
+            rows.append(row)
+
+        def flatten(tree):
+            result = []
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                sub = node.data
+                # only the leaves keep the indexes of their rows
+                rows = None if node.children else list(sub.indexes)
+                result.append((sub.depth, sub.rule(), sub.size(),
+                               sorted(sub.histogram('result').items()),
+                               rows))
+                stack.extend(reversed(node.children))
+            return result
+
+        serial = sut.C45.fromTable(rows).buildTree('result')
+        parallel = sut.C45.fromTable(rows).buildTree('result', workers=2,
+                                                     columnLevels=1)
+        self.assertEqual(flatten(serial), flatten(parallel))
+        self.assertGreater(len(flatten(serial)), 10)
+
+        target = sut.C45.fromTable(rows)
+        target.maxFeatures = 2
+        self.assertRaises(ValueError, target.buildTree, 'result', workers=2)
+
+    def test_numeric(self):
+        table = {'x': [str(v) for v in range(20)],
+                 'colour': ['red', 'blue'] * 10,
+                 'result': ['a'] * 8 + ['b'] * 12}
+        target = sut.C45(table)
+        self.assertTrue(target.isNumeric('x'))
+        self.assertFalse(target.isNumeric('colour'))
+
+        row, e = target.threshold('x', 'result')
+        self.assertEqual(7, row)
+        self.assertEqual(0, e)
+        self.assertEqual(target.info('result'), target.gain('x', 'result'))
+        self.assertGreater(target.gain('x', 'result'),
+                           target.gain('colour', 'result'))
+
+        left, right = target.partitionOnFeature('x', 'result')
+        self.assertEqual('x<=7', left.rule())
+        self.assertEqual('x>7', right.rule())
+        self.assertEqual(list(range(8)), list(left.indexes))
+
+        # without a result column there is no threshold to find
+        parts = target.partitionOnFeature('x')
+        self.assertEqual(20, len(parts))
+        self.assertEqual('x=3', parts[3].rule())
+        self.assertEqual([3], list(parts[3].indexes))
+
+        categorical = sut.C45(table, numeric=[])
+        self.assertFalse(categorical.isNumeric('x'))
+        self.assertRaises(ValueError, sut.C45, table, True, ['colour'])
+
+    def test_numeric_orders(self):
+        import random
+
+        rng = random.Random(5)
+        table = {'x': [rng.uniform(0, 1) for _ in range(200)],
+                 'y': [rng.uniform(0, 1) for _ in range(200)]}
+        table['result'] = ['in' if x < 0.3 or y > 0.6 else 'out'
+                           for x, y in zip(table['x'], table['y'])]
+        target = sut.C45(table)
+
+        tree = target.buildTree('result')
+        self.assertEqual(2, len(tree.children))
+        stack = list(tree.children)
+        while stack:
+            node = stack.pop()
+            sub = node.data
+            for col, order in sub.orders.items():
+                numbers = sub.store.numbers[col]
+                self.assertEqual(sorted(sub.indexes), sorted(order))
+                self.assertEqual(sorted(order, key=numbers.__getitem__),
+                                 list(order))
+            if not node.children:
+                self.assertEqual(1, len(sub.uniques('result')))
+            stack.extend(node.children)
+
+    def test_compile(self):
+        import os
+        import pickle
+        import random
+        import tempfile
+        from hew.classifiers.c45 import CompiledTree
+
+        rng = random.Random(7)
+        rows = []
+        for _ in range(300):
+            row = {'x': str(rng.randrange(100)),
+                   'colour': rng.choice(['red', 'green', 'blue'])}
+            row['result'] = ('yes' if (int(row['x']) < 40) ==
+                             (row['colour'] == 'red') else 'no')
+            rows.append(row)
+
+        tree = sut.C45.fromTable(rows).buildTree('result')
+        target = CompiledTree.fromTree(tree, 'result')
+        self.assertEqual(['colour', 'x'], sorted(target.fields))
+        expected = [row['result'] for row in rows]
+        self.assertEqual(expected, [target.predict(row) for row in rows])
+
+        fd, fileName = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            target.save(fileName)
+            loaded = CompiledTree.load(fileName)
+        finally:
+            os.remove(fileName)
+        copied = pickle.loads(pickle.dumps(target))
+        for other in (loaded, copied):
+            self.assertEqual(expected, other.predict_many(rows))
+        self.assertEqual(expected, target.predict_many(rows, workers=2,
+                                                       chunksize=50))
+
+        # an unseen colour, or an x that is not a number, stops at the root
+        # with its most common result; either column can win a tie for it
+        if target.fields[target.feature[0]] == 'colour':
+            row = {'x': '3', 'colour': 'mauve'}
+        else:
+            row = {'x': 'abc', 'colour': 'red'}
+        self.assertEqual(target.label[0], target.predict(row))
+        self.assertEqual(target.label[0],
+                         target.predict({'x': 'abc', 'colour': 'mauve'}))
+
+    def test_gainRatio(self):
+        table = {'id': [str(i) for i in range(8)],
+                 'colour': ['red', 'red', 'red', 'blue'] * 2,
+                 'result': ['a', 'a', 'a', 'b', 'a', 'a', 'b', 'b']}
+        target = sut.C45(table, numeric=[])
+        self.assertEqual('id', target._bestColumn(
+            [(k, target.score(k, 'result')) for k in ('id', 'colour')]))
+
+        target.criterion = 'gainRatio'
+        self.assertEqual('colour', target._bestColumn(
+            [(k, target.score(k, 'result')) for k in ('id', 'colour')]))
+        self.assertAlmostEqual(target.gain('id', 'result') / 3,
+                               target.gainRatio('id', 'result'))
+
+    def test_minSamples(self):
+        table = {'x': [str(v) for v in range(20)],
+                 'result': ['a'] * 2 + ['b'] * 18}
+        target = sut.C45(table)
+        self.assertEqual(1, target.threshold('x', 'result')[0])
+
+        target.minSamplesLeaf = 5
+        row, _ = target.threshold('x', 'result')
+        self.assertEqual(4, row)
+        tree = target.buildTree('result')
+        for node in tree.children:
+            self.assertGreaterEqual(node.data.size(), 5)
+
+        target = sut.C45(table)
+        target.minSamplesSplit = 21
+        self.assertEqual([], target.buildTree('result').children)
+
+    def test_prune(self):
+        import random
+
+        rng = random.Random(11)
+        rows = []
+        for _ in range(400):
+            row = {'f{0}'.format(j): str(rng.randrange(3)) for j in range(4)}
+            row['result'] = ('yes' if row['f0'] == '0' or rng.random() < 0.1
+                             else 'no')
+            rows.append(row)
+
+        def count(tree):
+            n = 0
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                n += 1
+                stack.extend(node.children)
+            return n
+
+        tree = sut.C45.fromTable(rows).buildTree('result')
+        grown = count(tree)
+        self.assertGreater(sut.C45.prune(tree, 'result'), 0)
+        self.assertLess(count(tree), grown)
+        self.assertGreater(len(tree.children), 0)
+        self.assertEqual(grown, sum(level['nodes']
+                                    for level in tree.data.stats.values()))
+        self.assertEqual(1, tree.data.stats[1]['nodes'])
+
+        # split tables keep only their size and results, which is all a
+        # pruned subtree needs to be written as a leaf
+        self.assertIsNone(tree.data.indexes)
+        self.assertEqual(400, tree.data.size())
+        out = StringIO()
+        sut.C45.outputDecision(tree, 'result', [], out)
+        self.assertEqual(400, sum(int(line.split('\t')[0])
+                                  for line in out.getvalue().splitlines()))
+
+    def test_histograms(self):
+        from collections import Counter
+
+        table = {'x': [str(v) for v in range(20)],
+                 'colour': ['red', 'blue'] * 10,
+                 'result': ['a'] * 8 + ['b'] * 12}
+        target = sut.C45(table)
+        for col in ('colour', 'x'):
+            for sub in target.partitionOnFeature(col, 'result'):
+                self.assertEqual(Counter(sub._codes('result')),
+                                 sub.histograms['result'])
+
+        # the parent entropy is computed once for every column scored
+        target = sut.C45(table)
+        target.info('result')
+        target.gain('colour', 'result')
+        self.assertEqual(1 + 2, target.entropies)
+        target.gain('colour', 'result')
+        self.assertEqual(1 + 2 + 2, target.entropies)
+
+        tree = target.buildTree('result')
+        self.assertEqual(tree.data.entropies, tree.data.stats[1]['entropies'])
+        self.assertEqual(0, tree.children[0].data.entropies)
+
+    def test_deepTree(self):
+        import inspect
+
+        # column cJ only tells row J apart, so each level peels off one row
+        depth = 150
+        rows = []
+        for i in range(depth + 20):
+            row = {'c{0:03d}'.format(j): 'y' if i == j else 'n'
+                   for j in range(depth)}
+            row['result'] = 'yes' if i < depth else 'no'
+            rows.append(row)
+        target = sut.C45.fromTable(rows)
+        target.maxDepth = None
+
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(len(inspect.stack()) + 100)
+        try:
+            tree = target.buildTree('result')
+            out = StringIO()
+            sut.C45.outputDecision(tree, 'result', [], out)
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertEqual(depth + 1, max(target.stats))
+        self.assertEqual(depth + 1, len(out.getvalue().splitlines()))
+
+    def test_checkpoint(self):
+        import os
+        import random
+        import tempfile
+        from hew.classifiers.c45 import TreeBuilder
+
+        rng = random.Random(4)
+        rows = []
+        for _ in range(300):
+            row = {'f{0}'.format(j): str(rng.randrange(2 + j))
+                   for j in range(5)}
+            row['x'] = str(rng.random())
+            row['result'] = str((int(row['f1']) + int(row['f3'])) % 3)
+            rows.append(row)
+
+        def flatten(tree):
+            result = []
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                sub = node.data
+                rows = None if node.children else list(sub.indexes)
+                result.append((sub.rule(), sub.size(),
+                               sorted(sub.histogram('result').items()),
+                               rows))
+                stack.extend(reversed(node.children))
+            return result
+
+        expected = flatten(sut.C45.fromTable(rows).buildTree('result'))
+
+        fd, fileName = tempfile.mkstemp(suffix='.pickle')
+        os.close(fd)
+        try:
+            table = sut.C45.fromTable(rows)
+            builder = TreeBuilder(table, 'result')
+            builder.step()
+            builder.step()
+            self.assertGreater(len(builder), 0)
+            builder.save(fileName)
+
+            resumed = TreeBuilder.load(fileName, sut.C45.fromTable(rows),
+                                       'result')
+            self.assertEqual(expected, flatten(resumed.build()))
+            self.assertRaises(ValueError, TreeBuilder.load, fileName,
+                              sut.C45.fromTable(rows[:10]), 'result')
+            self.assertRaises(ValueError, TreeBuilder.load, fileName,
+                              sut.C45.fromTable(rows), 'f0')
+            other = sut.C45.fromTable(rows)
+            other.criterion = 'gainRatio'
+            self.assertRaises(ValueError, other.buildTree, 'result',
+                              checkpoint=fileName)
+            other.criterion = 'gain'
+            other.minSamplesLeaf = 5
+            self.assertRaises(ValueError, TreeBuilder.load, fileName, other,
+                              'result')
+
+            tree = sut.C45.fromTable(rows).buildTree('result',
+                                                     checkpoint=fileName)
+            self.assertEqual(expected, flatten(tree))
+            self.assertFalse(os.path.exists(fileName))
+        finally:
+            if os.path.exists(fileName):
+                os.remove(fileName)
+
     def test_makeDecisionTree(self):
         sut.C45.makeDecisionTree(self.input, 'result', sys.stdout)
 
+    def test_fromFile(self):
+        import os
+        import tempfile
+
+        fd, fileName = tempfile.mkstemp(suffix='.tsv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('arg1\targ2\targ3\tresult\targX\n')
+            for row in self.input:
+                f.write('\t'.join(row[k] for k in
+                                  ('arg1', 'arg2', 'arg3', 'result', 'argX')))
+                f.write('\n')
+        try:
+            target = sut.C45.fromFile(fileName)
+        finally:
+            os.remove(fileName)
+        self.assertEqual(self.target.columnSet, target.columnSet)
+
+        expected = StringIO()
+        sut.C45.makeDecisionTree(self.input, 'result', expected)
+        actual = StringIO()
+        sut.C45.makeDecisionTree(target, 'result', actual)
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_outputDecision(self):
+        tree = self.target.buildTree('result')
+        out = StringIO()
+        sut.C45.outputDecision(tree, 'result', ['top'], out)
+        lines = [line.split('\t') for line in out.getvalue().splitlines()]
+        self.assertEqual(4, sum(int(count) for count, _, _, _ in lines))
+        for _, length, _, predicates in lines:
+            predicates = predicates.split(' & ')
+            self.assertEqual('top', predicates[0])
+            self.assertEqual(int(length), len(predicates))
+            self.assertEqual(len(predicates), len(set(predicates)))
+
 if __name__ == '__main__':
     unittest.main()
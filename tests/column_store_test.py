@@ -0,0 +1,62 @@
+import unittest
+from hew.structures.column_store import ColumnStore
+
+
+class Test_ColumnStore(unittest.TestCase):
+    def setUp(self):
+        self.target = ColumnStore.fromColumns({
+            'colour': ['red', 'blue', 'red', 'green'],
+            'size': ['s', 's', 's', 'l'],
+        })
+
+    def test_encoding(self):
+        self.assertEqual(4, len(self.target))
+        self.assertEqual([0, 1, 0, 2], list(self.target.codes['colour']))
+        self.assertEqual(['red', 'blue', 'green'],
+                         self.target.values['colour'])
+        self.assertEqual(2, self.target.encode('colour', 'green'))
+        self.assertIsNone(self.target.encode('colour', 'mauve'))
+        self.assertEqual('l', self.target.decode('size', 1))
+
+    def test_column(self):
+        self.assertEqual(['red', 'blue', 'red', 'green'],
+                         self.target.column('colour'))
+        self.assertEqual(['green', 'red'],
+                         self.target.column('colour', [3, 0]))
+        self.assertEqual([], self.target.column('size', []))
+
+    def test_numeric(self):
+        columns = {'n': [str(v % 12) for v in range(24)],
+                   'few': [str(v % 3) for v in range(24)],
+                   'mixed': ['x'] + [str(v) for v in range(23)]}
+        detected = ColumnStore.fromColumns(columns)
+        self.assertEqual(['n'], list(detected.numbers))
+        self.assertEqual(11., detected.numbers['n'][11])
+
+        declared = ColumnStore.fromColumns(columns, ['few'])
+        self.assertEqual(['few'], list(declared.numbers))
+        with self.assertRaises(ValueError):
+            ColumnStore.fromColumns(columns, ['mixed'])
+
+    def test_fromRows(self):
+        rows = [{'colour': 'red', 'size': 's'},
+                {'colour': 'blue', 'size': 's'},
+                {'colour': 'red', 'size': 's'},
+                {'colour': 'green', 'size': 'l'}]
+        target = ColumnStore.fromRows(iter(rows))
+        self.assertEqual(['colour', 'size'], target.names)
+        for name in target.names:
+            self.assertEqual(list(self.target.codes[name]),
+                             list(target.codes[name]))
+            self.assertEqual(self.target.values[name], target.values[name])
+
+        target.append({'colour': 'blue'})
+        self.assertEqual([None], target.column('size', [4]))
+
+    def test_contains(self):
+        self.assertIn('size', self.target)
+        self.assertNotIn('weight', self.target)
+        self.assertEqual(0, len(ColumnStore()))
+
+if __name__ == '__main__':
+    unittest.main()
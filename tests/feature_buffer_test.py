@@ -0,0 +1,97 @@
+import os
+import pickle
+import tempfile
+import unittest
+from array import array
+from hew.structures.feature_buffer import FeatureBuffer, SKIP, RAISE
+
+
+class Test_FeatureBuffer(unittest.TestCase):
+    def setUp(self):
+        self.table = [{'x': '0.5', 'y': '2', 'name': 'foo'},
+                      {'x': 'true', 'y': 'FALSE', 'name': 'bar'},
+                      {'x': '', 'y': '3'},
+                      {'y': 4.}]
+
+    def test_fromTable(self):
+        target = FeatureBuffer.fromTable(self.table, ['x', 'y'], ['name'])
+        self.assertEqual(4, len(target))
+        self.assertEqual((0.5, 2.), target[0])
+        self.assertEqual((1., 0.), target[1])
+        self.assertEqual((0., 3.), target[2])
+        self.assertEqual((0., 4.), target[-1])
+        self.assertEqual(['bar'], target.label(1))
+        self.assertEqual([''], target.label(3))
+
+    def test_iter(self):
+        target = FeatureBuffer.fromTable(self.table, ['y'])
+        self.assertEqual([(2.,), (0.,), (3.,), (4.,)], list(target))
+        self.assertEqual([2., 0., 3., 4.], list(target.column(0)))
+
+    def test_slice(self):
+        from hew.structures.vector import extractFloatVectors
+
+        target = extractFloatVectors(self.table, ['x', 'y'])
+        self.assertEqual([(0.5, 2.), (1., 0.)], target[0:2])
+        self.assertEqual([(0., 4.), (1., 0.)], target[::-2])
+        self.assertEqual([], target[9:])
+
+    def test_index_out_of_range(self):
+        target = FeatureBuffer.fromTable(self.table, ['x', 'y'])
+        with self.assertRaises(IndexError):
+            target[4]
+
+    def test_missing_value(self):
+        target = FeatureBuffer.fromTable(self.table, ['x', 'y'], missing=-1)
+        self.assertEqual((-1., 3.), target[2])
+
+    def test_missing_skip(self):
+        target = FeatureBuffer.fromTable(self.table, ['x', 'y'], ['name'],
+                                         missing=SKIP)
+        self.assertEqual(2, len(target))
+        self.assertEqual(2, target.skipped)
+        self.assertEqual([('foo', (0.5, 2.)), ('bar', (1., 0.))],
+                         [(l[0], x) for x, l in target.pairs()])
+
+    def test_missing_raise(self):
+        with self.assertRaises(ValueError):
+            FeatureBuffer.fromTable(self.table, ['x', 'y'], missing=RAISE)
+
+    def test_fromFile(self):
+        fd, fileName = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write('name\tx\ty\n')
+            f.write('foo\t1\t2\n')
+            f.write('bar\t3\t\n')
+        try:
+            target = FeatureBuffer.fromFile(fileName, ['x', 'y'], ['name'])
+        finally:
+            os.remove(fileName)
+
+        self.assertEqual([(1., 2.), (3., 0.)], list(target))
+        self.assertEqual(['bar'], target.label(1))
+
+    def test_save_load(self):
+        source = FeatureBuffer.fromTable(self.table, ['x', 'y'])
+        fd, fileName = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+        try:
+            source.save(fileName)
+            loaded = FeatureBuffer.load(fileName, ['x', 'y'], mmap=False)
+            self.assertEqual(list(source), list(loaded))
+
+            mapped = FeatureBuffer.load(fileName, ['x', 'y'])
+            self.assertEqual(4, len(mapped))
+            self.assertEqual((0., 3.), mapped[2])
+            self.assertEqual(list(source), list(mapped))
+            self.assertEqual(array('d', [2., 0., 3., 4.]), mapped.column(1))
+
+            # a process pool pickles the buffer as the name of its file
+            copied = pickle.loads(pickle.dumps(mapped))
+            self.assertEqual(list(source), list(copied))
+            del mapped, copied
+        finally:
+            os.remove(fileName)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,7 +53,7 @@ class Test_k_means(unittest.TestCase):
         from hew.clusters.k_means import optimal_clusters
 
         X = init_4_clusters(400)
-        actual = optimal_clusters(X, distance_fn, 10, 10)
+        actual = optimal_clusters(X, distance_fn, 10, 10, n_init=3)
         self.assertEqual(4, actual)
 
     def test_optimal_clusters_cosine(self):
@@ -61,9 +61,48 @@ class Test_k_means(unittest.TestCase):
         from hew.clusters.k_means import optimal_clusters
 
         X = init_4_clusters(400)
-        actual = optimal_clusters(X, distance_fn, 10, 10)
+        actual = optimal_clusters(X, distance_fn, 10, 10, n_init=3)
         self.assertEqual(4, actual)
 
+    def test_fromTable(self):
+        X = init_4_clusters()
+        table = ({'x': str(x), 'y': str(y)} for x, y in X)
+        target = KMeans.fromTable(4, table, ['x', 'y'], distance_fn)
+        self.assertEqual(len(X), len(target))
+        self.assertEqual(4, len(set(target)))
+
+    def test_optimal_clusters_parallel(self):
+        from hew.clusters.k_means import optimal_clusters
+
+        X = init_4_clusters(400)
+        serial = optimal_clusters(X, distance_fn, 8, 5, workers=1,
+                                  random_state=7, n_init=3)
+        parallel = optimal_clusters(X, distance_fn, 8, 5, workers=2,
+                                    random_state=7, n_init=3)
+        self.assertEqual(4, serial)
+        self.assertEqual(serial, parallel)
+
+    def test_optimal_clusters_random_state(self):
+        import random
+        from hew.clusters.k_means import optimal_clusters
+
+        # a serial search leaves the random state of the caller alone
+        X = init_4_clusters(100)
+        random.seed(1)
+        optimal_clusters(X, distance_fn, 4, 2, workers=1, random_state=7)
+        self.assertEqual(random.Random(1).random(), random.random())
+
+    def test_optimal_clusters_early_stop(self):
+        from hew.clusters.k_means import optimal_clusters
+
+        X = init_4_clusters(400)
+        reported = []
+        actual = optimal_clusters(X, distance_fn, 10, 5, workers=2,
+                                  early_stop=True, n_init=3,
+                                  progress=lambda k, n: reported.append(k))
+        self.assertEqual(4, actual)
+        self.assertEqual([1, 2, 3, 4, 5], reported)
+
     def test_kmeans_plus_plus(self):
         from hew.clusters.k_means import kmeans_plus_plus
 
@@ -82,6 +121,118 @@ class Test_k_means(unittest.TestCase):
                 found[3] = True
         self.assertTrue(all(found))
 
+    def test_kmeans_parallel(self):
+        from hew.clusters.k_means import kmeans_parallel
+
+        X = init_4_clusters()
+        actual = kmeans_parallel(X, 4, distance_fn)
+
+        quadrants = set((a[0] > 0, a[1] > 0) for a in actual)
+        self.assertEqual(4, len(quadrants))
+
+    def test_seeding_duplicates(self):
+        from hew.clusters.k_means import kmeans_parallel, kmeans_plus_plus
+
+        X = [(1., 1.)] * 10 + [(2., 2.)] * 10
+        for seeding in (kmeans_plus_plus, kmeans_parallel):
+            actual = seeding(X, 2, distance_fn)
+            self.assertEqual(set([(1., 1.), (2., 2.)]),
+                             set(tuple(a) for a in actual))
+
+    def test_init(self):
+        X = init_4_clusters()
+        for init in ('random', 'k-means++', 'k-means||'):
+            target = KMeans(4, X, distance_fn, init=init)
+            self.assertEqual(len(X), len(target))
+
+        with self.assertRaises(ValueError):
+            KMeans(4, X, distance_fn, init='forgy')
+
+    def test_random_state(self):
+        X = init_board_gauss(600, 5)
+        first = KMeans(5, X, distance_fn, random_state=3)
+        second = KMeans(5, X, distance_fn, random_state=3)
+        self.assertEqual(first.MU, second.MU)
+        self.assertEqual(list(first), list(second))
+
+    def test_n_init(self):
+        X = init_board_gauss(600, 5)
+        single = KMeans(5, X, distance_fn, random_state=1)
+        serial = KMeans(5, X, distance_fn, n_init=4, random_state=1,
+                        workers=1)
+        parallel = KMeans(5, X, distance_fn, n_init=4, random_state=1,
+                          workers=2)
+
+        self.assertEqual(serial.MU, parallel.MU)
+        self.assertEqual(list(serial), list(parallel))
+        # the single run is the first of the restarts
+        self.assertLessEqual(serial.Wk, single.Wk + 1e-9)
+
+    def test_groups(self):
+        X = init_4_clusters()
+        target = KMeans(4, X, distance_fn, True)
+
+        groups = target.groups
+        self.assertEqual(len(X), sum(len(g) for g in groups))
+        for j, g in enumerate(groups):
+            for i, x in zip(g.indexes, g):
+                self.assertEqual(j, target.clusterIndex[i])
+                self.assertEqual(X[i], x)
+
+        expected = sum(distance_fn(target.MU[j], x)
+                       for j, g in enumerate(groups) for x in g)
+        self.assertAlmostEqual(expected, target.Wk)
+
+    def test_inertia(self):
+        from hew.clusters.k_means import inertia
+        from hew.structures.vector import distance_manhattan
+
+        X = [(0., 0.), (2., 0.), (5., 5.)]
+        MU = [(1., 0.), (5., 3.)]
+        C = [0, 0, 1]
+        self.assertAlmostEqual(6., inertia(X, MU, C, distance_fn))
+        self.assertAlmostEqual(4., inertia(X, MU, C, distance_manhattan))
+        self.assertAlmostEqual(
+            4., inertia(X, MU, C, lambda a, b: distance_manhattan(a, b)))
+
+    def test_predict(self):
+        from hew.clusters.k_means import assign_clusters
+
+        X = init_board_gauss(2000, 10)
+        target = KMeans(100, X, distance_fn, True, max_iter=5)
+        self.assertIsNotNone(target.index)
+
+        expected = list(assign_clusters(X, target.MU, distance_fn))
+        self.assertEqual(expected, target.predict(X))
+
+        small = KMeans(4, X, distance_fn, True)
+        self.assertIsNone(small.index)
+        self.assertEqual(list(small), small.predict(X))
+        self.assertEqual([], small.predict([]))
+
+    def test_save_load(self):
+        import os
+        import tempfile
+        from hew.structures.metric import Manhattan
+
+        X = init_4_clusters()
+        for distance in (distance_fn, Manhattan([1., 2.])):
+            target = KMeans(4, X, distance, True)
+            fd, fileName = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+            try:
+                target.save(fileName)
+                loaded = KMeans.load(fileName)
+            finally:
+                os.remove(fileName)
+
+            self.assertEqual(distance, loaded.distance_fn)
+            self.assertEqual(4, loaded.k)
+            self.assertEqual(list(target), loaded.predict(X))
+
+        with self.assertRaises(ValueError):
+            KMeans(4, X, lambda a, b: 0.).save('unused.json')
+
     def test_lloyds(self):
         from hew.clusters.k_means import lloyds_algorithm
         from hew.structures.vector import distance_euclid_squared as distance_fn
@@ -105,6 +256,220 @@ class Test_k_means(unittest.TestCase):
         self.assertAlmostEqual(actual[3][0], 0.5, 1)
         self.assertAlmostEqual(actual[3][1], -0.5, 1)
 
+    def test_update_centroids(self):
+        from hew.clusters.k_means import update_centroids
+
+        X = [(0., 0.), (2., 0.), (5., 5.)]
+        actual = update_centroids(X, [0, 0, 2], [(9, 9), (1, 1), (4, 4)])
+        self.assertEqual([[1., 0.], [1, 1], [5., 5.]], actual)
+
+    def test_lloyds_vectorize(self):
+        from hew.clusters.k_means import lloyds_algorithm
+        from hew.structures.vector import (numpy, distance_manhattan,
+                                           distance_cosine_similarity)
+        if numpy is None:
+            self.skipTest('numpy is not installed')
+
+        X = init_board_gauss(1000, 5, 4)
+        MU = random.sample(X, 5)
+        for fn in [distance_fn, distance_manhattan,
+                   distance_cosine_similarity]:
+            expected = lloyds_algorithm(X, MU, fn, vectorize=False)
+            actual = lloyds_algorithm(X, MU, fn)
+            self.assertEqual(expected[1], actual[1])
+            self.assertEqual(expected[2], actual[2])
+
+    def test_accelerated(self):
+        from hew.clusters.k_means import (lloyds_algorithm, elkan_algorithm,
+                                          hamerly_algorithm)
+        from hew.structures.vector import distance_manhattan
+
+        X = init_board_gauss(1000, 8, 3)
+        MU = random.sample(X, 8)
+        for fn in [distance_fn, distance_manhattan]:
+            _, expected, iterations = lloyds_algorithm(X, MU, fn)
+            for algorithm in [elkan_algorithm, hamerly_algorithm]:
+                _, actual, actual_iterations = algorithm(X, MU, fn)
+                self.assertEqual(expected, actual)
+                self.assertEqual(iterations, actual_iterations)
+
+    def test_lloyds_stats(self):
+        from hew.clusters.k_means import lloyds_algorithm
+
+        X = init_board_gauss(1000, 5, 3)
+        MU = random.sample(X, 5)
+        stats = []
+        hooked = []
+        _, _, iterations = lloyds_algorithm(
+            X, MU, distance_fn, lambda MU, C, i: hooked.append(i),
+            stats_hook=stats.append)
+
+        self.assertEqual(list(range(1, iterations + 1)), hooked)
+        self.assertEqual(iterations, len(stats))
+        self.assertEqual(1000, stats[0]['changed'])
+        self.assertEqual(0, stats[-1]['changed'])
+        self.assertEqual(0, stats[-1]['shift'])
+        for before, after in zip(stats, stats[1:]):
+            self.assertLessEqual(after['inertia'], before['inertia'] + 1e-9)
+        for s in stats:
+            self.assertGreaterEqual(s['assign_seconds'], 0)
+            self.assertGreaterEqual(s['update_seconds'], 0)
+
+    def test_lloyds_max_iter(self):
+        from hew.clusters.k_means import lloyds_algorithm
+
+        X = init_board_gauss(1000, 5, 3)
+        MU = random.sample(X, 5)
+        _, _, iterations = lloyds_algorithm(X, MU, distance_fn, max_iter=2)
+        self.assertEqual(2, iterations)
+
+    def test_tolerance(self):
+        from hew.clusters.k_means import ALGORITHMS
+
+        X = init_board_gauss(2000, 10, 3)
+        MU = random.sample(X, 10)
+        for algorithm in ALGORITHMS.values():
+            _, _, exact = algorithm(X, MU, distance_fn)
+
+            stats = []
+            _, _, loose = algorithm(X, MU, distance_fn, tol=1e-3,
+                                    max_changed=20, stats_hook=stats.append)
+            self.assertLessEqual(loose, exact)
+            # the hook keeps the three arguments it always had
+            hooked = []
+            algorithm(X, MU, distance_fn,
+                      lambda MU, C, i: hooked.append(i), max_iter=2)
+            self.assertEqual([1, 2], hooked)
+            for s in stats[:-1]:
+                self.assertGreater(s['changed'], 20)
+
+    def test_skipped(self):
+        X = init_board_gauss(1000, 8, 3)
+        target = KMeans(8, X, distance_fn, True, algorithm='elkan')
+        self.assertEqual(target.iter, len(target.skipped))
+        self.assertEqual(0, target.skipped[0])
+        if target.iter > 2:
+            self.assertGreater(target.skipped[-1], 0)
+
+    def test_unknown_algorithm(self):
+        X = init_4_clusters()
+        with self.assertRaises(ValueError):
+            KMeans(4, X, distance_fn, True, algorithm='magic')
+
+    def assertFourCorners(self, MU):
+        found = sorted((round(mu[0], 1), round(mu[1], 1)) for mu in MU)
+        self.assertEqual([(-0.5, -0.5), (-0.5, 0.5), (0.5, -0.5), (0.5, 0.5)],
+                         found)
+
+    def test_minibatch(self):
+        from hew import MiniBatchKMeans
+
+        X = init_4_clusters(4000)
+        target = MiniBatchKMeans(4, distance_fn, batch_size=100, max_iter=50,
+                                 random_state=1).fit(X)
+        self.assertFourCorners(target.MU)
+
+        labels = list(target.labels(iter(X)))
+        self.assertEqual(len(X), len(labels))
+        self.assertEqual(4, len(set(labels)))
+        self.assertEqual(1000, labels.count(labels[0]))
+
+    def test_minibatch_iterator(self):
+        from hew import MiniBatchKMeans
+
+        X = init_4_clusters(4000)
+        random.shuffle(X)
+        target = MiniBatchKMeans(4, distance_fn, batch_size=200)
+        target.fit(x for x in X)
+        self.assertEqual(20, target.iter)
+        self.assertEqual(4000, sum(target.counts))
+        self.assertFourCorners(target.MU)
+
+    def test_minibatch_partial_fit(self):
+        from hew import MiniBatchKMeans
+
+        X = init_4_clusters(400)
+        random.shuffle(X)
+        target = MiniBatchKMeans(4, distance_fn)
+        with self.assertRaises(ValueError):
+            target.partial_fit(X[:3])
+        target.partial_fit(X[:200])
+        target.partial_fit(X[200:])
+        self.assertEqual(2, target.iter)
+        self.assertFourCorners(target.MU)
+
+    def test_run(self):
+        import csv
+        import os
+        import tempfile
+        from hew.clusters.k_means import buildArgParser
+
+        X = init_4_clusters()
+        fd, input = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write('name\tx\ty\tflag\n')
+            for i, (x, y) in enumerate(X):
+                f.write('p{0}\t{1}\t{2}\ttrue\n'.format(i, x, y))
+        fd, output = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+
+        try:
+            for extra in ([], ['--batch-size', '50']):
+                args = buildArgParser().parse_args(
+                    [input, '-c', '4', '-o', output, '--seed', '5',
+                     '--workers', '1', '--max-iter', '50'] + extra +
+                    ['x', 'y', 'flag'])
+                KMeans.run(args)
+
+                with open(output, 'r') as f:
+                    rows = list(csv.DictReader(f, dialect=csv.excel_tab))
+                self.assertEqual(len(X), len(rows))
+                self.assertEqual('p7', rows[7]['name'])
+                self.assertEqual(set('1234'),
+                                 set(r['cluster'] for r in rows))
+                # the points of a corner share a cluster
+                for start in range(0, len(X), len(X) // 4):
+                    corner = rows[start:start + len(X) // 4]
+                    self.assertEqual(1, len(set(r['cluster'] for r in corner)))
+        finally:
+            os.remove(input)
+            os.remove(output)
+
+    def test_run_blank_lines(self):
+        import csv
+        import os
+        import tempfile
+        from hew.clusters.k_means import buildArgParser
+
+        X = init_4_clusters()
+        fd, input = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write('name\tx\ty\n')
+            for i, (x, y) in enumerate(X):
+                f.write('p{0}\t{1}\t{2}\n'.format(i, x, y))
+                if i == 3:
+                    f.write('\n')
+            f.write('\n')
+        fd, output = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+
+        try:
+            args = buildArgParser().parse_args(
+                [input, '-c', '4', '-o', output, '--seed', '5',
+                 '--workers', '1', 'x', 'y'])
+            KMeans.run(args)
+
+            with open(output, 'r') as f:
+                rows = list(csv.DictReader(f, dialect=csv.excel_tab))
+            self.assertEqual(len(X), len(rows))
+            self.assertEqual('p{0}'.format(len(X) - 1), rows[-1]['name'])
+            for start in range(0, len(X), len(X) // 4):
+                corner = rows[start:start + len(X) // 4]
+                self.assertEqual(1, len(set(r['cluster'] for r in corner)))
+        finally:
+            os.remove(input)
+            os.remove(output)
+
     @unittest.skip('used for debugging command line')
     def test_commandLine(self):
         args = collections.namedtuple("Parsed",'input clusters resultColumn outputFileName fields')
@@ -115,6 +480,11 @@ class Test_k_means(unittest.TestCase):
         args.outputFileName = r'C:\Users\jfarley.15T-5CG3332ZD5\Documents\Personal\uw_clustered.txt'
         #args.fields = ['energy', 'instrumentalness']
         args.fields = ['danceability','energy', 'instrumentalness','speechiness','n_bpm']
+        args.workers = None
+        args.seed = None
+        args.max_iter = 300
+        args.n_init = 1
+        args.batch_size = 0
         #args.fields = ['acousticness','danceability','energy','instrumentalness',
         #               'liveness','speechiness','valence', 'n_bpm']
         KMeans.run(args)
@@ -3,6 +3,7 @@ import unittest
 import math
 from random import random
 from hew import KDTree, distance_fn
+from hew.structures.vector import distance_manhattan
 
 if sys.version >= '3':
     xrange = range
@@ -44,5 +45,175 @@ class Test_KDTree(unittest.TestCase):
         self.assertEqual(labels[1], 'den')
         self.assertTrue(0.2 < distance < 0.25)
 
+    def assertNearest(self, tree, points, lookups=200):
+        metric = tree.metric
+        for _ in xrange(lookups):
+            destination = [random() for _ in xrange(tree.k)]
+            _, _, mindistance = tree.nearest_neighbor(destination)
+
+            minsq = min(metric.distance(p, destination) for p, _ in points)
+            self.assertLess(abs(metric.finalize(minsq) - mindistance), 1e-8)
+
+    def test_nearest_neighbors(self):
+        points = [(tuple(random() for _ in xrange(4)), i)
+                  for i in xrange(1000)]
+        tree = KDTree(points)
+        tree.remove(0)
+        destination = [random() for _ in xrange(4)]
+
+        actual = tree.nearest_neighbors(destination, 10)
+        expected = sorted(math.sqrt(distance_fn(p, destination))
+                          for p, _ in points[1:])[:10]
+        self.assertEqual(10, len(actual))
+        for (_, _, a), e in zip(actual, expected):
+            self.assertAlmostEqual(e, a)
+
+    def test_approximate_exact(self):
+        points = [(tuple(random() for _ in xrange(5)), i)
+                  for i in xrange(1000)]
+        tree = KDTree(points)
+
+        for _ in xrange(100):
+            destination = [random() for _ in xrange(5)]
+            expected = tree.nearest_neighbor(destination)
+            actual = tree.approximate_nearest_neighbor(destination)
+            self.assertEqual(expected[1], actual[1])
+            self.assertEqual(expected[2], actual[2])
+            self.assertTrue(actual[3])
+
+    def test_approximate_eps(self):
+        eps = 0.5
+        points = [(tuple(random() for _ in xrange(10)), i)
+                  for i in xrange(2000)]
+        tree = KDTree(points)
+
+        for _ in xrange(100):
+            destination = [random() for _ in xrange(10)]
+            _, _, expected = tree.nearest_neighbor(destination)
+            _, _, actual, exact = tree.approximate_nearest_neighbor(
+                destination, eps)
+            self.assertLessEqual(actual, (1 + eps) * expected + 1e-12)
+            if exact:
+                self.assertEqual(expected, actual)
+
+    def test_approximate_max_visits(self):
+        points = [(tuple(random() for _ in xrange(10)), i)
+                  for i in xrange(2000)]
+        tree = KDTree(points, distance_manhattan)
+
+        inexact = 0
+        for _ in xrange(100):
+            destination = [random() for _ in xrange(10)]
+            _, _, expected = tree.nearest_neighbor(destination)
+            _, label, actual, exact = tree.approximate_nearest_neighbor(
+                destination, max_visits=20)
+            self.assertIsNotNone(label)
+            self.assertGreaterEqual(actual, expected)
+            if not exact:
+                inexact += 1
+            else:
+                self.assertEqual(expected, actual)
+        self.assertGreater(inexact, 0)
+
+    def test_manhattan(self):
+        points = [(tuple(random() for _ in xrange(4)), i)
+                  for i in xrange(1000)]
+        self.assertNearest(KDTree(points, distance_manhattan), points)
+
+    def test_chebyshev(self):
+        from hew.structures.metric import Chebyshev
+
+        points = [(tuple(random() for _ in xrange(4)), i)
+                  for i in xrange(1000)]
+        self.assertNearest(KDTree(points, Chebyshev()), points)
+
+    def test_weighted(self):
+        from hew.structures.metric import EuclideanSquared
+
+        points = [(tuple(random() for _ in xrange(3)), i)
+                  for i in xrange(1000)]
+        tree = KDTree(points, EuclideanSquared([100., 1., 0.01]))
+        self.assertNearest(tree, points)
+
+    def depth(self, node):
+        if node is None:
+            return 0
+        return 1 + max(self.depth(node.left), self.depth(node.right))
+
+    def test_insert(self):
+        k = 3
+        points = [(tuple(random() for _ in xrange(k)), i)
+                  for i in xrange(10)]
+        tree = KDTree(points)
+
+        # sorted input is the worst case for an unbalanced tree
+        for i in xrange(10, 1000):
+            p = (i / 1000., random(), random())
+            points.append((p, i))
+            tree.insert(p, i)
+
+        self.assertEqual(1000, len(tree))
+        self.assertLess(self.depth(tree.root), 30)
+        self.assertNearest(tree, points)
+
+    def test_remove(self):
+        k = 3
+        points = [(tuple(random() for _ in xrange(k)), i % 50)
+                  for i in xrange(500)]
+        tree = KDTree(points, background=False)
+
+        self.assertEqual(10, tree.remove(7))
+        self.assertEqual(0, tree.remove(7))
+        self.assertEqual(490, len(tree))
+        self.assertNearest(tree, [o for o in points if o[1] != 7])
+
+    def test_remove_rebuilds(self):
+        k = 2
+        points = [(tuple(random() for _ in xrange(k)), i)
+                  for i in xrange(100)]
+        tree = KDTree(points, rebuild_threshold=0.25, background=False)
+
+        for i in xrange(30):
+            tree.remove(i)
+
+        # rebuilt once the 26th point was removed
+        self.assertEqual(74, tree.root.size)
+        self.assertNearest(tree, points[30:])
+
+    def test_background_rebuild(self):
+        k = 2
+        points = [(tuple(random() for _ in xrange(k)), i)
+                  for i in xrange(2000)]
+        tree = KDTree(points)
+
+        tree.rebuild(background=True)
+        for i in xrange(2000, 2100):
+            p = (random(), random())
+            points.append((p, i))
+            tree.insert(p, i)
+        for i in xrange(100):
+            tree.remove(i)
+        tree.wait_for_rebuild()
+
+        self.assertEqual(2000, len(tree))
+        self.assertNearest(tree, points[100:])
+
+    def test_fromTable_remove(self):
+        table = [{'x': 0.3, 'y': 0.4, 'name': 'foo'},
+                 {'x': 0.2, 'y': 0.8, 'name': 'den'},
+                 ]
+
+        tree = KDTree.fromTable(table, ['x', 'y'], ['name'])
+        self.assertEqual(1, tree.remove(['den']))
+        _, labels, _ = tree.nearest_neighbor([0.2, 0.8])
+        self.assertEqual(['foo'], labels)
+
+        # a tuple finds the list labels built by fromTable
+        tree = KDTree.fromTable(table, ['x', 'y'], ['name'])
+        self.assertEqual(1, tree.remove(('den',)))
+        self.assertEqual(1, len(tree))
+        _, labels, _ = tree.nearest_neighbor([0.2, 0.8])
+        self.assertEqual(['foo'], labels)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from random import random
+from hew.structures import vector
+from hew.structures.metric import (Chebyshev, EuclideanSquared, Manhattan,
+                                   metric_for)
+
+
+class Test_Metric(unittest.TestCase):
+    def setUp(self):
+        self.a = [random() for _ in range(7)]
+        self.b = [random() for _ in range(7)]
+
+    def test_euclid(self):
+        self.assertEqual(vector.distance_euclid_squared(self.a, self.b),
+                         EuclideanSquared().distance(self.a, self.b))
+
+    def test_manhattan(self):
+        self.assertAlmostEqual(vector.distance_manhattan(self.a, self.b),
+                               Manhattan().distance(self.a, self.b))
+
+    def test_chebyshev(self):
+        self.assertEqual(vector.distance_chebyshev(self.a, self.b),
+                         Chebyshev().distance(self.a, self.b))
+
+    def test_weights(self):
+        target = EuclideanSquared([4, 1])
+        self.assertEqual(4 * 9 + 16, target([0, 0], [3, 4]))
+        self.assertEqual(36, target.axis_bound(3, 0))
+        self.assertEqual(9, target.axis_bound(3, 1))
+
+        target = Manhattan([4, 1])
+        self.assertEqual(4 * 3 + 4, target([0, 0], [3, -4]))
+
+        target = Chebyshev([4, 1])
+        self.assertEqual(12, target([0, 0], [3, -4]))
+
+    def test_metric_for(self):
+        self.assertEqual(EuclideanSquared(), metric_for(None))
+        self.assertEqual(Manhattan(),
+                         metric_for(vector.distance_manhattan))
+        target = Chebyshev([1, 2])
+        self.assertIs(target, metric_for(target))
+
+    def test_metric_for_unknown(self):
+        with self.assertRaises(ValueError):
+            metric_for(vector.distance_cosine_similarity)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import random
+import hew as sut
+
+
+def make_rows(n, seed):
+    """ The result follows f0 and x, with 10% of it flipped at random """
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        row = {'f{0}'.format(j): str(rng.randrange(3)) for j in range(5)}
+        row['x'] = str(rng.uniform(0, 1))
+        result = row['f0'] == '0' or float(row['x']) > 0.7
+        if rng.random() < 0.1:
+            result = not result
+        row['result'] = 'yes' if result else 'no'
+        rows.append(row)
+    return rows
+
+
+class Test_RandomForest(unittest.TestCase):
+    def setUp(self):
+        self.train = make_rows(400, 1)
+        self.test = make_rows(200, 2)
+
+    def test_fit(self):
+        target = sut.RandomForest.fromTable(self.train, 'result', nTrees=15,
+                                            seed=3)
+        self.assertEqual(15, len(target))
+        self.assertEqual(2, target.features(sut.C45.fromTable(self.train)))
+
+        expected = [row['result'] for row in self.test]
+        predicted = target.predict_many(self.test)
+        correct = sum(1 for a, b in zip(expected, predicted) if a == b)
+        self.assertGreater(correct, 0.8 * len(self.test))
+
+        votes = target.votes(self.test[0])
+        self.assertEqual(15, sum(votes.values()))
+        self.assertEqual(votes.most_common(1)[0][0],
+                         target.predict(self.test[0]))
+
+    def test_seed(self):
+        def grow(seed, workers=1):
+            return sut.RandomForest.fromTable(self.train, 'result', nTrees=4,
+                                              workers=workers, seed=seed)
+
+        first = grow(5)
+        for other in (grow(5), grow(5, workers=2)):
+            for a, b in zip(first.trees, other.trees):
+                self.assertEqual(list(a.feature), list(b.feature))
+                self.assertEqual(a.label, b.label)
+        self.assertNotEqual([list(t.feature) for t in first.trees],
+                            [list(t.feature) for t in grow(6).trees])
+
+        # each tree grows on its own sample
+        self.assertNotEqual(
+            (list(first.trees[0].feature), list(first.trees[0].threshold)),
+            (list(first.trees[1].feature), list(first.trees[1].threshold)))
+
+    def test_predict_many_parallel(self):
+        target = sut.RandomForest.fromTable(self.train, 'result', nTrees=5,
+                                            seed=7)
+        self.assertEqual(target.predict_many(self.test),
+                         target.predict_many(self.test, workers=2,
+                                             chunksize=30))
+
+if __name__ == '__main__':
+    unittest.main()
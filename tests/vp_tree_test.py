@@ -0,0 +1,64 @@
+import sys
+import unittest
+import math
+from random import random
+from hew.structures.vp_tree import VPTree
+from hew.structures.vector import (distance_cosine_similarity,
+                                   distance_euclid_squared,
+                                   distance_manhattan)
+
+if sys.version >= '3':
+    xrange = range
+
+
+class Test_VPTree(unittest.TestCase):
+    def setUp(self):
+        self.points = [(tuple(random() - 0.5 for _ in xrange(8)), i)
+                       for i in xrange(1000)]
+
+    def assertNearest(self, tree, distance, lookups=100):
+        for _ in xrange(lookups):
+            destination = [random() - 0.5 for _ in xrange(tree.k)]
+            _, _, mindistance = tree.nearest_neighbor(destination)
+
+            expected = min(distance(p, destination) for p, _ in self.points)
+            self.assertLess(abs(expected - mindistance), 1e-8)
+
+    def test_euclid(self):
+        tree = VPTree(self.points, distance_euclid_squared)
+        self.assertNearest(tree, lambda a, b: math.sqrt(
+            distance_euclid_squared(a, b)))
+
+    def test_manhattan(self):
+        tree = VPTree(self.points, distance_manhattan)
+        self.assertNearest(tree, distance_manhattan)
+
+    def test_cosine(self):
+        tree = VPTree(self.points, distance_cosine_similarity)
+        self.assertNearest(tree, distance_cosine_similarity)
+
+    def test_nearest_neighbors(self):
+        tree = VPTree(self.points)
+        destination = [random() - 0.5 for _ in xrange(8)]
+
+        actual = tree.nearest_neighbors(destination, 10)
+        expected = sorted(math.sqrt(distance_euclid_squared(p, destination))
+                          for p, _ in self.points)[:10]
+        self.assertEqual(10, len(actual))
+        for (_, _, a), e in zip(actual, expected):
+            self.assertAlmostEqual(e, a)
+
+    def test_fromTable(self):
+        table = [{'x': 0.3, 'y': 0.4, 'z': 0.5, 'name': 'foo', 'desc': 'bar'},
+                 {'x': 0.5, 'z': 0.9, 'name': 'baz', 'desc': 'qaz'},
+                 {'x': 0.2, 'y': 0.8, 'z': 0.2, 'desc': 'den'},
+                 ]
+
+        tree = VPTree.fromTable(table, ['x', 'y', 'z'], ['name', 'desc'])
+        points, labels, distance = tree.nearest_neighbor([0.1, 1, 0.1])
+        self.assertEqual((0.2, 0.8, 0.2), points)
+        self.assertEqual(['', 'den'], labels)
+        self.assertTrue(0.2 < distance < 0.25)
+
+if __name__ == '__main__':
+    unittest.main()